@@ -1,43 +1,469 @@
+"""LLM gateway client.
+
+All requests go through one ``AsyncOpenAI`` client (one pooled HTTP
+connection pool) running on a dedicated background event loop, and are
+bounded by a single process-wide limit of ``LLM_CONCURRENCY`` in-flight
+requests, shared by every pipeline stage and every job.
+
+The pipeline stages are thread-based (PyMuPDF work, ``llm_map`` fan-out),
+so the public API is blocking: ``chat``/``chat_many``/``vision_extract``
+submit requests to the loop and wait for the result. Stages fan out over
+the shared ``LLM_POOL`` rather than creating their own executors. An
+asyncio-native API for the stages is deferred until the pipeline itself
+runs on an event loop.
+
+Below that ceiling, text and vision requests each have their own
+``AdaptiveLimiter`` (AIMD: the limit grows by one per window of successes
+and halves on 429s, 503s and timeouts). Retryable failures are retried with
+full-jitter exponential backoff (honouring ``Retry-After``) until
+``LLM_MAX_RETRIES`` or the request's overall deadline is exhausted, and
+every attempt has its own timeout. Vision attempts can optionally be
+hedged (``LLM_VISION_HEDGE_PERCENTILE``): one that outlives a latency
+percentile learned from recent attempts is duplicated, and the first
+response wins, within an extra-request budget of ``LLM_HEDGE_BUDGET``.
+
+When ``LLM_CACHE_PATH`` is set, successful responses are stored in the
+persistent cache from ``llm_cache.py``, so byte-identical requests on a
+rerun are answered from disk without touching the gateway. Identical
+requests that are in flight at the same time (e.g. the same estimate
+uploaded by several users at once) are coalesced: only the first goes to
+the gateway and every caller gets its parsed result.
+
+Each call is recorded (model, ``stage`` label, latency, bytes, tokens,
+outcome) in ``metrics.py``. Stages fan out with ``llm_map`` so the calls
+are also attributed to the job that made them.
+"""
+
+import asyncio
+import contextvars
 import os
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Coroutine, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TypeVar
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
+
+from .llm_cache import get_llm_cache, message_size, request_key
+from .metrics import LLMCall, LLMMetrics, current_metrics, record_call
 
 load_dotenv()
 
-client = OpenAI(
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Max LLM requests in flight across the whole process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "16"))
+# Per-model-class adaptive budgets (upper bounds for the AIMD limiters)
+LLM_TEXT_CONCURRENCY = int(os.getenv("LLM_TEXT_CONCURRENCY", str(LLM_CONCURRENCY)))
+LLM_VISION_CONCURRENCY = int(os.getenv("LLM_VISION_CONCURRENCY", str(max(1, LLM_CONCURRENCY // 2))))
+# Retries after the first attempt, and the time limits in seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TEXT_TIMEOUT = float(os.getenv("LLM_TEXT_TIMEOUT", "60"))
+LLM_VISION_TIMEOUT = float(os.getenv("LLM_VISION_TIMEOUT", "120"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "300"))  # per request, across all retries
+# Hedged vision requests: duplicate an attempt still running past this latency
+# percentile of recent attempts (0 disables), spending at most LLM_HEDGE_BUDGET
+# extra requests per request sent
+LLM_VISION_HEDGE_PERCENTILE = float(os.getenv("LLM_VISION_HEDGE_PERCENTILE", "0"))
+LLM_HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.05"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+_BACKOFF_BASE = 0.5
+_BACKOFF_CAP = 20.0
+_HEDGE_WINDOW = 200  # recent attempt latencies the hedge threshold is learned from
+_HEDGE_BURST = 5.0  # max unspent hedge tokens, so a quiet spell cannot fund a flood
+# Status codes worth retrying; the overload ones also shrink the adaptive limit
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+_OVERLOAD_STATUS = {429, 503}
+
+client = AsyncOpenAI(
     api_key=os.getenv("GATEWAY_API_KEY"),
-    base_url="https://api.llmgateway.ciridae.app",
+    base_url=os.getenv("GATEWAY_BASE_URL", "https://api.llmgateway.ciridae.app"),
+    max_retries=0,  # retries are handled here, with the adaptive limiter in the loop
 )
 
+# Caller threads for the synchronous pipeline stages; more threads than the
+# concurrency limit would only queue on the limiter
+LLM_POOL = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY, thread_name_prefix="llm-caller")
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one class of requests (only used on the LLM loop).
+
+    The limit starts at ``maximum``, grows by ``1 / limit`` per success (about
+    +1 per full window) and halves on an overload signal. Only requests sent
+    after the last decrease can trigger the next one, so a burst of 429s
+    from a single window counts as one signal.
+    """
+
+    def __init__(self, name: str, maximum: int, minimum: int = 1):
+        self.name = name
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond: asyncio.Condition | None = None
+
+    async def acquire(self) -> float:
+        """Wait for a slot; returns the start time to hand back to ``release``."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started: float, overloaded: bool = False, succeeded: bool = False) -> None:
+        if overloaded and started >= self._last_decrease:
+            self.limit = max(float(self.minimum), self.limit / 2)
+            self._last_decrease = time.monotonic()
+        elif succeeded:
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+
+class HedgePolicy:
+    """When to duplicate a slow attempt (only used on the LLM loop).
+
+    The delay is the ``percentile`` of the last ``_HEDGE_WINDOW`` successful
+    attempt latencies, measured from when the request was sent, so time
+    spent queueing on a limiter never triggers a hedge. Every attempt
+    earns ``budget`` tokens, up to ``_HEDGE_BURST``, and each hedge spends
+    one. Extra requests therefore stay near ``budget`` of the total.
+    """
+
+    def __init__(self, percentile: float, budget: float, min_samples: int = LLM_HEDGE_MIN_SAMPLES):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies: deque[float] = deque(maxlen=_HEDGE_WINDOW)
+        self.tokens = 0.0
+        self.hedged = 0
+        self.won = 0
+
+    def observe(self, latency: float) -> None:
+        self.latencies.append(latency)
+
+    def delay(self) -> float | None:
+        """Seconds to wait before hedging an attempt, or None while still learning."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def earn(self) -> None:
+        self.tokens = min(_HEDGE_BURST, self.tokens + self.budget)
+
+    def spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.hedged += 1
+        return True
+
+
+@dataclass(frozen=True)
+class _Budget:
+    limiter: AdaptiveLimiter
+    timeout: float  # per attempt
+    hedge: HedgePolicy | None = None
+
+
+TEXT_BUDGET = _Budget(AdaptiveLimiter("text", LLM_TEXT_CONCURRENCY), LLM_TEXT_TIMEOUT)
+VISION_BUDGET = _Budget(
+    AdaptiveLimiter("vision", LLM_VISION_CONCURRENCY),
+    LLM_VISION_TIMEOUT,
+    HedgePolicy(LLM_VISION_HEDGE_PERCENTILE, LLM_HEDGE_BUDGET) if LLM_VISION_HEDGE_PERCENTILE > 0 else None,
+)
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+_limiter = asyncio.Semaphore(LLM_CONCURRENCY)  # only ever used on ``_loop``
+# Identical requests currently in flight, by request key (only touched on ``_loop``)
+_inflight: dict[str, tuple[asyncio.Task, "_Flight"]] = {}
+
+
+def _llm_loop() -> asyncio.AbstractEventLoop:
+    """The background event loop that owns ``client`` and ``_limiter``."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True).start()
+            _loop = loop
+    return _loop
+
+
+def _run(coro: Coroutine):
+    """Run ``coro`` on the LLM loop and block the calling thread for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _llm_loop()).result()
+
+
+def _classify_error(exc: Exception) -> tuple[bool, bool]:
+    """Return (retryable, overload signal) for a failed attempt."""
+    if isinstance(exc, (APITimeoutError, asyncio.TimeoutError)):
+        return True, True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code in _RETRY_STATUS, exc.status_code in _OVERLOAD_STATUS
+    if isinstance(exc, APIConnectionError):
+        return True, False
+    return False, False
+
+
+def _backoff(attempt: int, exc: Exception) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After when it gives one."""
+    if isinstance(exc, APIStatusError):
+        retry_after = exc.response.headers.get("retry-after")
+        try:
+            return min(_BACKOFF_CAP, float(retry_after)) + random.uniform(0, _BACKOFF_BASE)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(_BACKOFF_CAP, _BACKOFF_BASE * 2 ** attempt))
+
+
+@dataclass
+class _Flight:
+    """Gateway-side details of one (possibly shared) request, filled in as it runs."""
+    request_bytes: int = 0
+    response_bytes: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    attempts: int = 0
+    hedges: int = 0
+    cache_hit: bool = False
+
+
+async def _parse(
+    model: str, messages: list[dict], response_model: type, budget: _Budget,
+    stage: str, job_metrics: LLMMetrics | None,
+):
+    """Return the parsed response, sharing one request among identical in-flight calls."""
+    start = time.monotonic()
+    key = request_key(model, messages, response_model)
+    joined = key in _inflight
+    if not joined:
+        flight = _Flight(request_bytes=message_size(messages))
+        task = asyncio.ensure_future(_cached_request(key, model, messages, response_model, budget, flight))
+        _inflight[key] = (task, flight)
+        task.add_done_callback(lambda t: _finish_inflight(key, t))
+    task, flight = _inflight[key]
+
+    def _record(outcome: str) -> None:
+        call = LLMCall(model=model, stage=stage, outcome=outcome, latency=time.monotonic() - start)
+        if not joined:
+            # Gateway usage is attributed to the caller that issued the request
+            call.request_bytes = flight.request_bytes
+            call.response_bytes = flight.response_bytes
+            call.prompt_tokens = flight.prompt_tokens
+            call.completion_tokens = flight.completion_tokens
+            call.attempts = flight.attempts
+            call.hedges = flight.hedges
+        record_call(call, job_metrics)
+
+    try:
+        # Shielded so one waiter giving up does not cancel the request for the others
+        parsed = await asyncio.shield(task)
+    except Exception:
+        _record("error")
+        raise
+    _record("coalesced" if joined else "cache_hit" if flight.cache_hit else "ok")
+    return parsed
+
+
+def _finish_inflight(key: str, task: asyncio.Task) -> None:
+    _inflight.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # mark retrieved even if every waiter was cancelled
+
+
+async def _cached_request(
+    key: str, model: str, messages: list[dict], response_model: type, budget: _Budget, flight: _Flight,
+):
+    """Return the parsed response, from the persistent cache when possible.
+
+    SQLite reads and writes (including eviction scans) run in a worker
+    thread so they never stall other requests on the LLM loop.
+    """
+    cache = get_llm_cache()
+    hit = await asyncio.to_thread(cache.get, key, response_model) if cache else None
+    if hit is not None:
+        flight.cache_hit = True
+        return hit
+    parsed = await _request(model, messages, response_model, budget, flight)
+    if cache and parsed is not None:
+        await asyncio.to_thread(cache.put, key, parsed)
+    return parsed
+
+
+async def _request(model: str, messages: list[dict], response_model: type, budget: _Budget, flight: _Flight):
+    deadline = time.monotonic() + LLM_DEADLINE
+    attempt = 0
+    while True:
+        timeout = max(1.0, min(budget.timeout, deadline - time.monotonic()))
+        try:
+            if budget.hedge is not None:
+                completion = await _hedged_attempt(model, messages, response_model, budget, timeout, flight)
+            else:
+                completion = await _attempt(model, messages, response_model, budget, timeout, flight)
+            message = completion.choices[0].message
+            flight.response_bytes = len((message.content or "").encode())
+            if completion.usage is not None:
+                flight.prompt_tokens = completion.usage.prompt_tokens or 0
+                flight.completion_tokens = completion.usage.completion_tokens or 0
+            return message.parsed
+        except Exception as exc:
+            retryable, _ = _classify_error(exc)
+            delay = _backoff(attempt, exc)
+            if not retryable or attempt >= LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                raise
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+async def _attempt(
+    model: str, messages: list[dict], response_model: type, budget: _Budget, timeout: float, flight: _Flight,
+    sent: asyncio.Event | None = None,
+):
+    """Send one request under the budget's limiter; ``sent`` is set once it leaves the queue."""
+    started = await budget.limiter.acquire()
+    overloaded = succeeded = False
+    flight.attempts += 1
+    try:
+        async with _limiter:
+            if sent is not None:
+                sent.set()
+            t0 = time.monotonic()
+            completion = await client.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_model,
+                timeout=timeout,
+            )
+        succeeded = True
+        if budget.hedge is not None:
+            budget.hedge.observe(time.monotonic() - t0)
+        return completion
+    except Exception as exc:
+        _, overloaded = _classify_error(exc)
+        raise
+    finally:
+        await budget.limiter.release(started, overloaded=overloaded, succeeded=succeeded)
+
+
+async def _hedged_attempt(
+    model: str, messages: list[dict], response_model: type, budget: _Budget, timeout: float, flight: _Flight,
+):
+    """``_attempt``, duplicated once if it outlives the hedge delay; the first success wins.
+
+    The losing request is cancelled, which closes its connection.
+    """
+    hedge = budget.hedge
+    hedge.earn()
+    sent = asyncio.Event()
+    primary = asyncio.ensure_future(_attempt(model, messages, response_model, budget, timeout, flight, sent))
+    tasks = {primary}
+    try:
+        waiter = asyncio.ensure_future(sent.wait())
+        await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        delay = hedge.delay()
+        if delay is None or primary.done():
+            return await primary
+        await asyncio.wait({primary}, timeout=delay)
+        if primary.done() or not hedge.spend():
+            return await primary
+        flight.hedges += 1
+        backup = asyncio.ensure_future(_attempt(model, messages, response_model, budget, timeout, flight))
+        tasks.add(backup)
+        error: BaseException | None = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is backup:
+                        hedge.won += 1
+                    return task.result()
+                if task is primary or error is None:
+                    error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _chat_messages(system: str, user: str) -> list[dict]:
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+def _vision_messages(image_b64: str, system_prompt: str) -> list[dict]:
+    # Accept a ready-made data URL (any image type) to avoid re-copying the payload
+    image_url = image_b64 if image_b64.startswith("data:") else f"data:image/png;base64,{image_b64}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Extract data from this page."},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ],
+        },
+    ]
+
+
+def chat(system: str, user: str, response_model: type, model: str = "fast-production", stage: str = "other"):
+    return _run(_parse(
+        model, _chat_messages(system, user), response_model, TEXT_BUDGET, stage, current_metrics.get(),
+    ))
+
+
+def chat_many(
+    system: str, users: list[str], response_model: type, model: str = "fast-production", stage: str = "other",
+) -> list:
+    """Blocking ``chat`` over several user messages at once, concurrently on the LLM loop.
+
+    For callers already running in ``LLM_POOL``, where fanning out with a
+    nested ``llm_map`` could exhaust the pool's threads.
+    """
+    job_metrics = current_metrics.get()
+
+    async def _all():
+        return await asyncio.gather(*(
+            _parse(model, _chat_messages(system, user), response_model, TEXT_BUDGET, stage, job_metrics)
+            for user in users
+        ))
+
+    return _run(_all())
+
+
+def vision_extract(
+    image_b64: str, response_model: type, system_prompt: str, model: str = "claude-3-7-sonnet",
+    stage: str = "other",
+):
+    return _run(_parse(
+        model, _vision_messages(image_b64, system_prompt), response_model, VISION_BUDGET,
+        stage, current_metrics.get(),
+    ))
 
-def chat(system: str, user: str, response_model: type, model: str = "fast-production"):
-    completion = client.chat.completions.parse(
-        model=model,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        response_format=response_model,
-    )
-    return completion.choices[0].message.parsed
-
-
-def vision_extract(image_b64: str, response_model: type, system_prompt: str, model: str = "claude-3-7-sonnet"):
-    completion = client.chat.completions.parse(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Extract data from this page."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}},
-                ],
-            },
-        ],
-        response_format=response_model,
-    )
-    return completion.choices[0].message.parsed
 
+def llm_map(fn: Callable[[T], R], items: Iterable[T]) -> Iterator[R]:
+    """``LLM_POOL.map`` that runs each call in a copy of the caller's context.
 
+    Keeps context variables such as ``metrics.current_metrics`` (per-job LLM
+    metrics) visible inside the pool threads.
+    """
+    ctx = contextvars.copy_context()
+    return LLM_POOL.map(lambda item: ctx.copy().run(fn, item), items)
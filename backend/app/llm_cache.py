@@ -0,0 +1,178 @@
+"""Persistent SQLite cache for structured LLM responses.
+
+Entries are keyed by a hash of the model, the full message list (system
+prompt and user content, including image data URLs) and the JSON schema of
+the ``response_format`` model, and store the parsed response as JSON. A
+prompt, schema or model change therefore never returns a stale shape.
+Entries expire after ``LLM_CACHE_TTL`` seconds. The least recently used
+ones are evicted once the stored responses exceed ``LLM_CACHE_MAX_BYTES``.
+
+The cache is off unless ``LLM_CACHE_PATH`` is set: it replays earlier
+(nondeterministic) model output, which suits reruns during development
+and evaluation rather than production jobs.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import TypeVar
+
+from pydantic import BaseModel
+
+# Opt-in: empty (the default) disables the cache
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def _message_parts(messages: list[dict]) -> Iterator[str]:
+    """Each message's role and content strings, image data URLs passed through as-is."""
+    for message in messages:
+        yield message["role"]
+        content = message["content"]
+        if isinstance(content, str):
+            yield content
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                yield part["text"]
+            elif part.get("type") == "image_url":
+                yield part["image_url"]["url"]
+                if (detail := part["image_url"].get("detail")) is not None:
+                    yield detail
+            else:
+                yield json.dumps(part, sort_keys=True, separators=(",", ":"))
+
+
+def message_size(messages: list[dict]) -> int:
+    """UTF-8 size in bytes of the message strings (the request body without its JSON framing)."""
+    # isascii() is O(1) on CPython, so base64 image URLs are measured without encoding them
+    return sum(len(part) if part.isascii() else len(part.encode()) for part in _message_parts(messages))
+
+
+@functools.cache
+def _schema_json(response_model: type[BaseModel]) -> str:
+    return json.dumps(response_model.model_json_schema(), sort_keys=True)
+
+
+def request_key(model: str, messages: list[dict], response_model: type[BaseModel]) -> str:
+    """Hash everything that determines the response of a structured-output request.
+
+    Message strings are fed to the hash one by one (each prefixed with its
+    length) rather than serialized together, so multi-MB image data URLs
+    are hashed without being copied into a JSON document first.
+    """
+    h = hashlib.sha256()
+    h.update(model.encode())
+    h.update(b"\0")
+    for part in _message_parts(messages):
+        data = part.encode()
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    h.update(b"\0")
+    h.update(_schema_json(response_model).encode())
+    return h.hexdigest()
+
+
+class LLMCache:
+    """Thread-safe SQLite cache of parsed responses with TTL and size-based LRU eviction."""
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        ttl: float = LLM_CACHE_TTL,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._size: int | None = None  # lazily computed total of ``size``
+
+    def get(self, key: str, model: type[T]) -> T | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if now - created > self.ttl:
+                self._delete(key)
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        try:
+            return model.model_validate_json(value)
+        except ValueError:
+            with self._lock:
+                self._delete(key)
+            return None
+
+    def put(self, key: str, value: BaseModel) -> None:
+        data = value.model_dump_json()
+        now = time.time()
+        with self._lock:
+            if self._size is None:
+                self._size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._size += len(data) - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict(now)
+
+    def _delete(self, key: str) -> None:
+        row = self._db.execute("DELETE FROM responses WHERE key = ? RETURNING size", (key,)).fetchone()
+        if row and self._size is not None:
+            self._size -= row[0]
+
+    def _evict(self, now: float) -> None:
+        """Drop expired entries, then least recently used ones until under 90% of the budget."""
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        target = int(self.max_bytes * 0.9)
+        size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if size > target:
+            cutoff = None
+            rows = self._db.execute("SELECT accessed, size FROM responses ORDER BY accessed").fetchall()
+            for accessed, entry_size in rows:
+                if size <= target:
+                    break
+                size -= entry_size
+                cutoff = accessed
+            if cutoff is not None:
+                self._db.execute("DELETE FROM responses WHERE accessed <= ?", (cutoff,))
+            size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._size = size
+
+
+_default_cache: LLMCache | None = None
+_default_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache | None:
+    """Return the process-wide LLM cache, or None if disabled (empty ``LLM_CACHE_PATH``)."""
+    global _default_cache
+    if not LLM_CACHE_PATH:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = LLMCache(LLM_CACHE_PATH)
+    return _default_cache
@@ -6,12 +6,13 @@ import tempfile
 from dataclasses import dataclass, field
 from uuid import uuid4
 
-from fastapi import FastAPI, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, Form, HTTPException, UploadFile
+from fastapi.responses import FileResponse, PlainTextResponse
 
+from app.metrics import METRICS, LLMMetrics, current_metrics
 from app.pipeline.annotate import annotate_pdf
-from app.pipeline.matching import compare_documents
-from app.pipeline.parse import parse_document
+from app.pipeline.matching import ComparisonState, compare_documents
+from app.pipeline.parse import ParseStats, parse_document
 from app.schemas import ComparisonResult, MatchColor
 
 app = FastAPI()
@@ -42,6 +43,13 @@ class Job:
     result: ComparisonResult | None = None
     output_pdf: str | None = None
     summary: dict | None = None
+    parse_stats: dict[str, ParseStats] = field(
+        default_factory=lambda: {"jdr": ParseStats(), "insurance": ParseStats()}
+    )
+    llm_metrics: LLMMetrics = field(default_factory=LLMMetrics)
+    previous_job_id: str | None = None  # earlier job whose room matches this one may reuse
+    comparison_state: ComparisonState = field(default_factory=ComparisonState)
+    reuse_skipped: str | None = None  # why the previous job's matches were not reused
 
 
 jobs: dict[str, Job] = {}
@@ -90,6 +98,19 @@ def _job_response(job: Job) -> dict:
         resp["progress"] = job.progress
     if job.summary:
         resp["summary"] = job.summary
+    if job.status != "pending":
+        resp["parse_stats"] = {src: s.as_dict() for src, s in job.parse_stats.items()}
+        fast = sum(s.fast_pages for s in job.parse_stats.values())
+        escalated = sum(s.escalated_pages for s in job.parse_stats.values())
+        if fast or escalated:
+            resp["escalation_rate"] = round(escalated / (fast + escalated), 3)
+        resp["llm"] = job.llm_metrics.summary()
+    if job.status in ("annotating", "complete"):
+        resp["comparison"] = job.comparison_state.as_dict()
+        if job.previous_job_id:
+            resp["comparison"]["previous_job_id"] = job.previous_job_id
+        if job.reuse_skipped:
+            resp["comparison"]["reuse_skipped"] = job.reuse_skipped
     if job.error:
         resp["error"] = job.error
     return resp
@@ -101,6 +122,8 @@ def _job_response(job: Job) -> dict:
 
 
 async def _run_pipeline(job: Job) -> None:
+    # Attribute every LLM call made on behalf of this job (propagates into to_thread)
+    current_metrics.set(job.llm_metrics)
     try:
         # --- Parsing (progress reported per-page via callback) ---
         import threading
@@ -126,8 +149,14 @@ async def _run_pipeline(job: Job) -> None:
 
         combined = jdr_pages + ins_pages
         jdr_doc, ins_doc = await asyncio.gather(
-            asyncio.to_thread(parse_document, job.jdr_path, "jdr", _on_step, combined, 0),
-            asyncio.to_thread(parse_document, job.ins_path, "insurance", _on_step, combined, jdr_pages),
+            asyncio.to_thread(
+                parse_document, job.jdr_path, "jdr", _on_step, combined, 0,
+                stats=job.parse_stats["jdr"],
+            ),
+            asyncio.to_thread(
+                parse_document, job.ins_path, "insurance", _on_step, combined, jdr_pages,
+                stats=job.parse_stats["insurance"],
+            ),
         )
 
         # --- Matching ---
@@ -135,7 +164,17 @@ async def _run_pipeline(job: Job) -> None:
         job.step = 0
         job.total_steps = 1
         job.progress = "Mapping rooms and matching line items..."
-        result = await asyncio.to_thread(compare_documents, jdr_doc, ins_doc)
+        previous = jobs.get(job.previous_job_id) if job.previous_job_id else None
+        previous_state = None
+        if previous is not None and previous.status != "complete":
+            job.reuse_skipped = f"previous job not complete (status: {previous.status})"
+        elif previous is not None:
+            previous_state = previous.comparison_state
+        if previous_state is not None:
+            job.progress = "Matching rooms changed since the previous job..."
+        result = await asyncio.to_thread(
+            compare_documents, jdr_doc, ins_doc, previous_state, job.comparison_state,
+        )
         job.step = 1
 
         # --- Annotating ---
@@ -165,7 +204,9 @@ async def _run_pipeline(job: Job) -> None:
 
 
 @app.post("/api/jobs")
-async def create_job(jdr: UploadFile, insurance: UploadFile) -> dict:
+async def create_job(jdr: UploadFile, insurance: UploadFile, previous_job_id: str | None = Form(None)) -> dict:
+    if previous_job_id and previous_job_id not in jobs:
+        raise HTTPException(status_code=404, detail="Previous job not found")
     job_id = uuid4().hex
     tmp = tempfile.mkdtemp(prefix=f"ciridae-{job_id}-")
 
@@ -177,7 +218,7 @@ async def create_job(jdr: UploadFile, insurance: UploadFile) -> dict:
     with open(ins_path, "wb") as f:
         f.write(await insurance.read())
 
-    job = Job(id=job_id, jdr_path=jdr_path, ins_path=ins_path)
+    job = Job(id=job_id, jdr_path=jdr_path, ins_path=ins_path, previous_job_id=previous_job_id)
     jobs[job_id] = job
 
     asyncio.create_task(_run_pipeline(job))
@@ -185,6 +226,11 @@ async def create_job(jdr: UploadFile, insurance: UploadFile) -> dict:
     return _job_response(job)
 
 
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(METRICS.prometheus(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/jobs/{job_id}")
 async def get_job(job_id: str) -> dict:
     job = jobs.get(job_id)
@@ -0,0 +1,155 @@
+"""LLM call instrumentation.
+
+Every ``chat``/``vision_extract`` call produces one ``LLMCall`` record that
+is added to the process-wide ``METRICS`` (served by ``GET /metrics`` in
+Prometheus text format) and to the current job's collector, if any. The
+job collector is found through the ``current_metrics`` context variable.
+``main._run_pipeline`` sets it, and ``llm.llm_map`` carries it into the
+stage worker threads.
+"""
+
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+# ``LLMCall`` fields summed per (model, stage)
+_TOTAL_FIELDS = ("request_bytes", "response_bytes", "prompt_tokens", "completion_tokens", "attempts", "hedges")
+
+
+@dataclass
+class LLMCall:
+    model: str
+    stage: str
+    outcome: str  # ok | cache_hit | coalesced (joined an identical in-flight request) | error
+    latency: float  # seconds, as seen by the caller
+    request_bytes: int = 0
+    response_bytes: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    attempts: int = 0  # gateway requests including retries and hedges (0 if served without one)
+    hedges: int = 0  # duplicate requests sent for slow attempts
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        """(le label, cumulative count) pairs including +Inf."""
+        out, running = [], 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            out.append((f"{bound:g}", running))
+        out.append(("+Inf", self.count))
+        return out
+
+
+class LLMMetrics:
+    """Thread-safe aggregation of ``LLMCall`` records by (model, stage)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: dict[tuple[str, str, str], int] = {}  # (model, stage, outcome) -> count
+        self.latency: dict[tuple[str, str], Histogram] = {}
+        self.request_size: dict[tuple[str, str], Histogram] = {}
+        self.totals: dict[tuple[str, str], dict[str, int]] = {}
+
+    def record(self, call: LLMCall) -> None:
+        key = (call.model, call.stage)
+        with self._lock:
+            ckey = (call.model, call.stage, call.outcome)
+            self.calls[ckey] = self.calls.get(ckey, 0) + 1
+            self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(call.latency)
+            if call.request_bytes:
+                self.request_size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(call.request_bytes)
+            totals = self.totals.setdefault(key, dict.fromkeys(_TOTAL_FIELDS, 0))
+            for name in _TOTAL_FIELDS:
+                totals[name] += getattr(call, name)
+
+    def summary(self) -> dict:
+        """Per-stage breakdown (all models combined) for the job status response."""
+        stages: dict[str, dict] = {}
+        with self._lock:
+            for (model, stage, outcome), n in self.calls.items():
+                entry = stages.setdefault(stage, {
+                    "calls": 0, "outcomes": {}, "models": [], "latency_seconds": 0.0,
+                    **dict.fromkeys(_TOTAL_FIELDS, 0),
+                })
+                entry["calls"] += n
+                entry["outcomes"][outcome] = entry["outcomes"].get(outcome, 0) + n
+                if model not in entry["models"]:
+                    entry["models"].append(model)
+            for (model, stage), hist in self.latency.items():
+                stages[stage]["latency_seconds"] += hist.sum
+            for (model, stage), totals in self.totals.items():
+                for name, value in totals.items():
+                    stages[stage][name] += value
+        for entry in stages.values():
+            entry["latency_seconds"] = round(entry["latency_seconds"], 3)
+        return stages
+
+    def prometheus(self) -> str:
+        """Render counters and histograms in the Prometheus text exposition format."""
+        lines: list[str] = []
+        with self._lock:
+            lines += [
+                "# HELP llm_calls_total LLM calls by model, stage and outcome.",
+                "# TYPE llm_calls_total counter",
+            ]
+            for (model, stage, outcome), n in sorted(self.calls.items()):
+                lines.append(f"llm_calls_total{{{_labels(model=model, stage=stage, outcome=outcome)}}} {n}")
+            for name, help_text, hists in (
+                ("llm_call_duration_seconds", "LLM call latency as seen by the caller.", self.latency),
+                ("llm_request_size_bytes", "UTF-8 size of LLM request messages.", self.request_size),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (model, stage), hist in sorted(hists.items()):
+                    labels = _labels(model=model, stage=stage)
+                    for le, cum in hist.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cum}')
+                    lines.append(f"{name}_sum{{{labels}}} {hist.sum:g}")
+                    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+            for field, help_text in (
+                ("request_bytes", "Message bytes sent to the gateway (UTF-8, without JSON framing)."),
+                ("response_bytes", "Response content bytes received from the gateway."),
+                ("prompt_tokens", "Prompt tokens reported by the gateway."),
+                ("completion_tokens", "Completion tokens reported by the gateway."),
+                ("attempts", "Gateway requests including retries and hedges."),
+                ("hedges", "Duplicate requests sent for slow attempts."),
+            ):
+                name = f"llm_{field}_total"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for (model, stage), totals in sorted(self.totals.items()):
+                    lines.append(f"{name}{{{_labels(model=model, stage=stage)}}} {totals[field]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels: str) -> str:
+    """Prometheus label set with values escaped per the text exposition format."""
+    def escape(value: str) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+METRICS = LLMMetrics()
+current_metrics: ContextVar[LLMMetrics | None] = ContextVar("current_metrics", default=None)
+
+
+def record_call(call: LLMCall, job_metrics: LLMMetrics | None) -> None:
+    METRICS.record(call)
+    if job_metrics is not None:
+        job_metrics.record(call)
@@ -5,12 +5,10 @@ adds sticky-note annotations with LLM-generated rationale, and appends
 summary pages for insurance-only (nugget) items.
 """
 
-from concurrent.futures import ThreadPoolExecutor
-
 import fitz
 from pydantic import BaseModel
 
-from ..llm import chat
+from ..llm import chat, llm_map
 from ..schemas import (
     ComparisonResult,
     ExtractedLineItem,
@@ -19,8 +17,6 @@ from ..schemas import (
     RoomComparison,
 )
 
-_LLM_POOL = ThreadPoolExecutor(max_workers=8)
-
 # Highlight colors (RGB 0-1) — match the ground truth markup palette
 HIGHLIGHT_COLORS: dict[MatchColor, tuple[float, float, float]] = {
     MatchColor.GREEN: (0.0, 1.0, 0.0),       # #00ff00
@@ -96,7 +92,7 @@ def _generate_comments(room: RoomComparison) -> list[str]:
     )
 
     total = len(items_parts)
-    result = chat(COMMENT_PROMPT, user_msg, _RoomComments)
+    result = chat(COMMENT_PROMPT, user_msg, _RoomComments, stage="comment")
 
     comments = [c.comment for c in result.comments]
     # Pad or truncate to match expected count
@@ -244,7 +240,7 @@ def annotate_pdf(
         print(f"  Generating comments for {room_label} ({n_items} items)...", flush=True)
         return _generate_comments(room)
 
-    all_comments = list(_LLM_POOL.map(_gen_comments, rooms_with_items))
+    all_comments = list(llm_map(_gen_comments, rooms_with_items))
     comments_by_idx = {i: c for (i, _), c in zip(rooms_with_items, all_comments)}
 
     # Step 2: Sequential highlight application (fitz not thread-safe)
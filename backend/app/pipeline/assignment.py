@@ -0,0 +1,96 @@
+"""Small combinatorial helpers shared by the parsing and matching stages."""
+
+import bisect
+import math
+
+
+def min_cost_assignment(cost: list[list[float]]) -> list[int]:
+    """Solve the rectangular assignment problem (Hungarian algorithm, O(n²·m)).
+
+    ``cost`` has one row per worker and at least as many columns as rows.
+    Returns, for each row, the column assigned to it so that no column is
+    used twice and the summed cost is minimal.
+    """
+    n = len(cost)
+    if n == 0:
+        return []
+    m = len(cost[0])
+    if m < n:
+        raise ValueError("min_cost_assignment needs at least as many columns as rows")
+
+    # 1-indexed potentials/matching, column 0 is a virtual start column
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    match = [0] * (m + 1)  # column -> row
+    way = [0] * (m + 1)
+    for row in range(1, n + 1):
+        match[0] = row
+        j0 = 0
+        minv = [math.inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            delta = math.inf
+            j1 = 0
+            costs = cost[i0 - 1]
+            ui0 = u[i0]
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                cur = costs[j - 1] - ui0 - v[j]
+                if cur < minv[j]:
+                    minv[j] = cur
+                    way[j] = j0
+                if minv[j] < delta:
+                    delta = minv[j]
+                    j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+
+    result = [0] * n
+    for j in range(1, m + 1):
+        if match[j]:
+            result[match[j] - 1] = j - 1
+    return result
+
+
+class IntervalSet:
+    """Union of closed 1-D intervals with O(log n) overlap queries.
+
+    Overlapping intervals are merged on ``add``, so the stored intervals
+    stay sorted and disjoint and a query only has to look at its
+    neighbours.
+    """
+
+    def __init__(self):
+        self._starts: list[float] = []
+        self._ends: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def overlaps(self, start: float, end: float) -> bool:
+        """True if (start, end) overlaps any stored interval (touching does not count)."""
+        i = bisect.bisect_left(self._starts, end)
+        return i > 0 and self._ends[i - 1] > start
+
+    def add(self, start: float, end: float) -> None:
+        lo = bisect.bisect_left(self._ends, start)
+        hi = bisect.bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
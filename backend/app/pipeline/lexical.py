@@ -0,0 +1,172 @@
+"""Lexical similarity between line-item descriptions.
+
+Descriptions are reduced to word/number tokens, and two descriptions are
+compared by the cosine of their IDF-weighted token sets. IDF is computed
+over the items being compared, so words every item shares ("remove",
+"replace", "paint" in a paint-heavy room) count for little and distinctive
+ones ("bathtub", "baseboard") dominate.
+
+``similarity_matrix`` scores every pair of two item lists at once with
+NumPy, blending the word score with character-trigram TF-IDF cosine, which
+tolerates abbreviations and small spelling differences ("R&R" / "Remove &
+replace", "w/profile" / "w/ profile").
+
+``CandidateIndex`` is a sparse (inverted) version of the trigram TF-IDF
+for top-k lookups against a whole document. A query only touches the
+postings of its own trigrams.
+"""
+
+import math
+import re
+from collections import Counter
+from collections.abc import Iterable
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+_STOPWORDS = frozenset({
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "of", "on", "or", "per", "the", "to", "up", "w", "with",
+})
+
+
+def tokens(text: str) -> frozenset[str]:
+    """Distinct lowercase word and number tokens of ``text``, without stopwords."""
+    return frozenset(
+        t for t in _TOKEN_RE.findall(text.lower())
+        if t not in _STOPWORDS and (len(t) > 1 or t.isdigit())
+    )
+
+
+def idf_weights(docs: Iterable[frozenset[str]]) -> dict[str, float]:
+    """Smoothed inverse document frequency of every token in ``docs``."""
+    df: Counter[str] = Counter()
+    n = 0
+    for doc in docs:
+        df.update(doc)
+        n += 1
+    return {t: math.log((1 + n) / (1 + c)) + 1 for t, c in df.items()}
+
+
+class Similarity:
+    """Cosine similarity of IDF-weighted token sets over a fixed vocabulary."""
+
+    def __init__(self, docs: Iterable[frozenset[str]]):
+        self.idf = idf_weights(docs)
+        self._norms: dict[frozenset[str], float] = {}
+
+    def _norm(self, doc: frozenset[str]) -> float:
+        norm = self._norms.get(doc)
+        if norm is None:
+            norm = self._norms[doc] = math.sqrt(sum(self.idf.get(t, 1.0) ** 2 for t in doc))
+        return norm
+
+    def __call__(self, a: frozenset[str], b: frozenset[str]) -> float:
+        shared = a & b
+        if not shared:
+            return 0.0
+        return sum(self.idf.get(t, 1.0) ** 2 for t in shared) / (self._norm(a) * self._norm(b))
+
+
+def normalize(text: str) -> str:
+    """Lowercase word/number tokens of ``text`` joined by single spaces."""
+    return " ".join(_TOKEN_RE.findall(text.lower()))
+
+
+def char_ngrams(text: str, n: int = 3) -> list[str]:
+    padded = f" {normalize(text)} "
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+def tfidf_matrix(docs: list[Iterable[str]]) -> np.ndarray:
+    """Row-normalized TF-IDF matrix (one row per doc) over the docs' own vocabulary."""
+    vocab: dict[str, int] = {}
+    rows: list[int] = []
+    cols: list[int] = []
+    for r, doc in enumerate(docs):
+        for term in doc:
+            rows.append(r)
+            cols.append(vocab.setdefault(term, len(vocab)))
+    matrix = np.zeros((len(docs), len(vocab)), dtype=np.float32)
+    np.add.at(matrix, (rows, cols), 1.0)
+    df = np.count_nonzero(matrix, axis=0)
+    matrix *= np.log((1 + len(docs)) / (1 + df)).astype(np.float32) + 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def similarity_matrix(a: list[str], b: list[str]) -> np.ndarray:
+    """(len(a), len(b)) similarity of every pair of descriptions, in [0, 1].
+
+    The mean of word-token and character-trigram TF-IDF cosine similarity,
+    with IDF taken over both lists.
+    """
+    if not a or not b:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    docs = a + b
+    words = tfidf_matrix([tokens(text) for text in docs])
+    grams = tfidf_matrix([char_ngrams(text) for text in docs])
+    n = len(a)
+    return 0.5 * (words[:n] @ words[n:].T) + 0.5 * (grams[:n] @ grams[n:].T)
+
+
+class CandidateIndex:
+    """Sparse character-trigram TF-IDF index over a fixed list of descriptions.
+
+    Postings are stored CSR-style, sorted by trigram: ``_ptr[t]:_ptr[t + 1]``
+    slices ``_docs``/``_weights`` for trigram ``t``.
+    """
+
+    def __init__(self, texts: list[str]):
+        self.size = len(texts)
+        grams = [Counter(char_ngrams(text)) for text in texts]
+        self._vocab: dict[str, int] = {}
+        terms: list[int] = []
+        docs: list[int] = []
+        counts: list[float] = []
+        for d, counter in enumerate(grams):
+            for gram, count in counter.items():
+                terms.append(self._vocab.setdefault(gram, len(self._vocab)))
+                docs.append(d)
+                counts.append(count)
+        terms_arr = np.array(terms, dtype=np.int64)
+        docs_arr = np.array(docs, dtype=np.int64)
+        df = np.bincount(terms_arr, minlength=len(self._vocab))
+        self._idf = (np.log((1 + self.size) / (1 + df)) + 1).astype(np.float32)
+        weights = np.array(counts, dtype=np.float32) * self._idf[terms_arr]
+        norms = np.sqrt(np.bincount(docs_arr, weights=weights ** 2, minlength=self.size))
+        norms[norms == 0] = 1
+        weights /= norms[docs_arr]
+
+        order = np.argsort(terms_arr, kind="stable")
+        self._docs = docs_arr[order]
+        self._weights = weights[order].astype(np.float32)
+        self._ptr = np.concatenate(([0], np.cumsum(df)))
+
+    def scores(self, text: str) -> np.ndarray:
+        """Cosine similarity of ``text`` to every indexed description."""
+        query = Counter(char_ngrams(text))
+        ids = [(self._vocab[g], c) for g, c in query.items() if g in self._vocab]
+        if not ids:
+            return np.zeros(self.size, dtype=np.float32)
+        terms = np.array([t for t, _ in ids], dtype=np.int64)
+        q = np.array([c for _, c in ids], dtype=np.float32) * self._idf[terms]
+        # Unknown trigrams still count towards the query norm
+        norm = math.sqrt(float(q @ q) + sum(c * c for g, c in query.items() if g not in self._vocab))
+        starts, ends = self._ptr[terms], self._ptr[terms + 1]
+        lengths = ends - starts
+        positions = np.repeat(ends - lengths.cumsum(), lengths) + np.arange(lengths.sum())
+        contrib = self._weights[positions] * np.repeat(q / norm, lengths)
+        return np.bincount(self._docs[positions], weights=contrib, minlength=self.size).astype(np.float32)
+
+    def top_k(self, text: str, k: int, allowed: np.ndarray | None = None, min_score: float = 0.0) -> list[tuple[int, float]]:
+        """Up to ``k`` (index, score) pairs, best first, among ``allowed`` (a boolean mask)."""
+        scores = self.scores(text)
+        if allowed is not None:
+            scores = np.where(allowed, scores, 0.0)
+        k = min(k, self.size)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > min_score]
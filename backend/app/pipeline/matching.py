@@ -1,9 +1,14 @@
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import math
+import os
+from dataclasses import dataclass, field
 from decimal import Decimal
+from operator import itemgetter
 
+import numpy as np
 from pydantic import BaseModel
 
-from ..llm import chat
+from ..llm import chat, chat_many, llm_map
 from ..schemas import (
     ComparisonResult,
     DiffNote,
@@ -13,9 +18,77 @@ from ..schemas import (
     ParsedDocument,
     RoomComparison,
 )
+from .lexical import CandidateIndex, Similarity, similarity_matrix, tokens
 from .room_mapping import RoomGroup, map_rooms
 
-_LLM_POOL = ThreadPoolExecutor(max_workers=8)
+# Pairs at least this similar (see ``lexical.similarity_matrix``), with the same
+# unit and clearly better than either item's runner-up, are matched locally
+# before the LLM call (0 disables the pre-match)
+PREMATCH_THRESHOLD = float(os.getenv("PREMATCH_THRESHOLD", "0.9"))
+_PREMATCH_MARGIN = 0.05
+
+# Rooms with more items than this on either side are matched in blocks of
+# about this many items on the larger side (0 sends every room in one request)
+MATCH_CHUNK_ITEMS = int(os.getenv("MATCH_CHUNK_ITEMS", "40"))
+# An insurance item also joins its runner-up block(s) when they score this
+# close to its best, up to _MAX_BLOCKS_PER_ITEM blocks in all
+_BLOCK_OVERLAP = 0.6
+_MAX_BLOCKS_PER_ITEM = 2
+# Insurance items per block may exceed an even share by this factor
+_BLOCK_SLACK = 1.5
+# Extra requests for JDR items that lost an insurance item to another block
+_RECONCILE_ROUNDS = 2
+
+# JDR items still unmatched after the per-room pass are offered up to this
+# many unmatched insurance items from other rooms (0 disables the pass)
+CROSS_ROOM_CANDIDATES = int(os.getenv("CROSS_ROOM_CANDIDATES", "5"))
+# Minimum trigram similarity for a cross-room candidate
+_CROSS_ROOM_MIN_SCORE = 0.3
+# Leftover JDR items per confirmation request
+_CROSS_ROOM_BATCH = 15
+
+# Relative difference allowed per field before a matched pair is orange
+PAIR_TOLERANCES = {"quantity": 0.02, "unit_price": 0.02, "total": 0.02}
+# Order in which diff notes are listed
+_DIFF_FIELDS = ("unit", "quantity", "unit_price", "total")
+# Absorbs float rounding of a - b, so columns agree with the Decimal comparison at the boundary
+_FLOAT_SLACK = 1e-12
+
+
+RoomKey = tuple[str | None, str | None, str, str]
+
+
+@dataclass
+class ComparisonState:
+    """Room-level results of a comparison, kept so a revision can reuse them.
+
+    ``room_pairs`` maps (JDR room, insurance room, JDR items hash, insurance
+    items hash) to that room's matched index pairs from the per-room pass,
+    before cross-room matches are added.
+    """
+    jdr_rooms: list[str] = field(default_factory=list)
+    ins_rooms: list[str] = field(default_factory=list)
+    groups: list[RoomGroup] = field(default_factory=list)
+    room_pairs: dict[RoomKey, list[tuple[int, int]]] = field(default_factory=dict)
+    reused_rooms: int = 0  # rooms whose matches came from the previous comparison
+    matched_rooms: int = 0  # rooms matched in this comparison
+    room_mapping_reused: bool = False
+
+    def as_dict(self) -> dict:
+        return {
+            "reused_rooms": self.reused_rooms,
+            "matched_rooms": self.matched_rooms,
+            "room_mapping_reused": self.room_mapping_reused,
+        }
+
+
+def _items_hash(items: list[ExtractedLineItem]) -> str:
+    """Hash of the fields matching looks at, in order (not page numbers or bboxes)."""
+    h = hashlib.sha256()
+    for item in items:
+        h.update(repr((item.description, item.quantity, item.unit, item.unit_price, item.total)).encode())
+        h.update(b"\0")
+    return h.hexdigest()
 
 
 class _ItemMatch(BaseModel):
@@ -37,6 +110,16 @@ Rules:
 - Only match items you are confident refer to the same scope of work. Leave items unmatched if unsure.
 - Return indices as 0-based integers referring to the numbered lists provided."""
 
+CROSS_ROOM_PROMPT = """\
+You are comparing line items from two construction repair proposals for the same property.
+The JDR (contractor) items below were not matched within their own room. Each one is listed with insurance items from OTHER rooms that have similar descriptions — the insurance estimate may have filed the same work under a different room name.
+
+Rules:
+- Match a JDR item only to one of the insurance items listed under it, and only if they clearly refer to the same work.
+- Each item can appear in at most one match. Do not double-match.
+- Most JDR items here will have no match; leave them out rather than guess.
+- Return jdr_index as the JDR item's number and ins_index as the insurance item's number, both 0-based as shown."""
+
 
 def _within_tolerance(a: Decimal | None, b: Decimal | None, pct: float = 0.02) -> bool:
     if a is None or b is None:
@@ -45,10 +128,16 @@ def _within_tolerance(a: Decimal | None, b: Decimal | None, pct: float = 0.02) -
         return True
     if a == 0 or b == 0:
         return False
-    return abs(float(a - b) / float(a)) <= pct
+    # Exact: float division puts e.g. 0.56 / 5.6 just above 10%
+    return abs(a - b) <= abs(a) * Decimal(str(pct))
 
 
-def _classify_pair(jdr: ExtractedLineItem, ins: ExtractedLineItem) -> tuple[MatchColor, list[DiffNote]]:
+def _classify_pair(
+    jdr: ExtractedLineItem,
+    ins: ExtractedLineItem,
+    tolerances: dict[str, float] = PAIR_TOLERANCES,
+) -> tuple[MatchColor, list[DiffNote]]:
+    """Color and diff notes for one matched pair; ``classify_pairs`` gives the same result in bulk."""
     diffs: list[DiffNote] = []
 
     units_match = (jdr.unit or "").strip().upper() == (ins.unit or "").strip().upper()
@@ -58,78 +147,479 @@ def _classify_pair(jdr: ExtractedLineItem, ins: ExtractedLineItem) -> tuple[Matc
         # different measurement systems (e.g. LF vs SF, HR vs EA).
         # Flag the unit difference and compare totals instead.
         diffs.append(DiffNote(field="unit", jdr_value=str(jdr.unit or ""), ins_value=str(ins.unit or "")))
-        if not _within_tolerance(jdr.total, ins.total):
+        if not _within_tolerance(jdr.total, ins.total, tolerances["total"]):
             diffs.append(DiffNote(field="total", jdr_value=str(jdr.total or ""), ins_value=str(ins.total or "")))
     else:
-        if not _within_tolerance(jdr.quantity, ins.quantity):
+        if not _within_tolerance(jdr.quantity, ins.quantity, tolerances["quantity"]):
             diffs.append(DiffNote(field="quantity", jdr_value=str(jdr.quantity or ""), ins_value=str(ins.quantity or "")))
 
-        if not _within_tolerance(jdr.unit_price, ins.unit_price):
+        if not _within_tolerance(jdr.unit_price, ins.unit_price, tolerances["unit_price"]):
             diffs.append(DiffNote(field="unit_price", jdr_value=str(jdr.unit_price or ""), ins_value=str(ins.unit_price or "")))
 
     color = MatchColor.GREEN if not diffs else MatchColor.ORANGE
     return color, diffs
 
 
-def _format_item_list(items: list[ExtractedLineItem]) -> str:
-    lines = []
-    for i, item in enumerate(items):
-        qty = f"{item.quantity}" if item.quantity is not None else "?"
-        unit = item.unit or "?"
-        price = f"${item.unit_price}" if item.unit_price is not None else "$?"
-        lines.append(f"  [{i}] {item.description} | qty={qty} {unit} | price={price}")
-    return "\n".join(lines)
+def _within_tolerance_columns(a: np.ndarray, b: np.ndarray, pct: float) -> np.ndarray:
+    """Vectorized ``_within_tolerance`` over float columns (NaN = missing)."""
+    a_missing, b_missing = np.isnan(a), np.isnan(b)
+    a_zero, b_zero = a == 0, b == 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = np.abs(a - b) / np.abs(a)
+    return np.where(
+        a_missing | b_missing,
+        a_missing & b_missing,
+        np.where(a_zero | b_zero, a_zero & b_zero, relative <= pct + _FLOAT_SLACK),
+    )
 
 
-def _match_room_items(
-    jdr_items: list[ExtractedLineItem],
-    ins_items: list[ExtractedLineItem],
-) -> tuple[list[MatchedPair], list[ExtractedLineItem], list[ExtractedLineItem]]:
-    if not jdr_items or not ins_items:
-        return [], list(jdr_items), list(ins_items)
+def classify_columns(
+    jdr_quantity: np.ndarray,
+    ins_quantity: np.ndarray,
+    jdr_unit_price: np.ndarray,
+    ins_unit_price: np.ndarray,
+    jdr_total: np.ndarray,
+    ins_total: np.ndarray,
+    jdr_unit: np.ndarray,
+    ins_unit: np.ndarray,
+    tolerances: dict[str, float] = PAIR_TOLERANCES,
+) -> dict[str, np.ndarray]:
+    """Which fields differ, for n pairs given as columns, in one pass.
+
+    Numeric columns are float arrays with NaN for a missing value; unit
+    columns hold normalized (stripped, uppercase) unit strings. Returns a
+    boolean (n,) mask per field in ``_DIFF_FIELDS``, with the same rules as
+    ``_classify_pair``. A pair is orange when any of its masks is set.
+    """
+    units_differ = jdr_unit != ins_unit
+    return {
+        "unit": units_differ,
+        "quantity": ~units_differ & ~_within_tolerance_columns(jdr_quantity, ins_quantity, tolerances["quantity"]),
+        "unit_price": ~units_differ & ~_within_tolerance_columns(jdr_unit_price, ins_unit_price, tolerances["unit_price"]),
+        "total": units_differ & ~_within_tolerance_columns(jdr_total, ins_total, tolerances["total"]),
+    }
+
+
+_ITEM_FIELDS = itemgetter("quantity", "unit_price", "total", "unit")
+
+
+def _float_column(values: tuple[Decimal | None, ...]) -> np.ndarray:
+    return np.array([math.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+
+def _unit_column(units: tuple[str | None, ...]) -> np.ndarray:
+    normalized = {u: (u or "").strip().upper() for u in set(units)}
+    return np.array([normalized[u] for u in units])
+
+
+@dataclass
+class PairColumns:
+    """Matched (JDR, insurance) pairs with the fields classification reads as columns.
+
+    Building the columns reads every item once, which costs about as much as
+    ``_classify_pair`` over the same pairs. After that, classifying under any
+    tolerances is a single NumPy pass, so re-evaluating the same pairs under
+    several tolerance settings (``eval_matching.py tolerances``) pays the
+    per-item cost once instead of once per setting.
+    """
+    pairs: list[tuple[ExtractedLineItem, ExtractedLineItem]]
+    columns: tuple[np.ndarray, ...]
+
+    @classmethod
+    def from_pairs(cls, pairs: list[tuple[ExtractedLineItem, ExtractedLineItem]]) -> "PairColumns":
+        if not pairs:
+            empty = np.empty(0)
+            return cls(pairs, (empty,) * 8)
+        # Plain dict reads; pydantic attribute access is measurably slower per item
+        jdr_quantity, jdr_unit_price, jdr_total, jdr_unit = zip(*[_ITEM_FIELDS(jdr.__dict__) for jdr, _ in pairs])
+        ins_quantity, ins_unit_price, ins_total, ins_unit = zip(*[_ITEM_FIELDS(ins.__dict__) for _, ins in pairs])
+        columns = (
+            _float_column(jdr_quantity), _float_column(ins_quantity),
+            _float_column(jdr_unit_price), _float_column(ins_unit_price),
+            _float_column(jdr_total), _float_column(ins_total),
+            _unit_column(jdr_unit), _unit_column(ins_unit),
+        )
+        return cls(pairs, columns)
+
+    def diff_codes(self, tolerances: dict[str, float] = PAIR_TOLERANCES) -> np.ndarray:
+        """Differing fields per pair as a bit set over ``_DIFF_FIELDS`` (0 = green)."""
+        diffs = classify_columns(*self.columns, tolerances)
+        codes = np.zeros(len(self.pairs), dtype=np.int64)
+        for bit, name in enumerate(_DIFF_FIELDS):
+            codes |= diffs[name].astype(np.int64) << bit
+        return codes
+
+    def classify(self, tolerances: dict[str, float] = PAIR_TOLERANCES) -> list[tuple[MatchColor, list[DiffNote]]]:
+        """``_classify_pair`` for every pair; ``DiffNote``s are only built for orange pairs."""
+        codes = self.diff_codes(tolerances)
+        fields_for = [[f for bit, f in enumerate(_DIFF_FIELDS) if code >> bit & 1] for code in range(1 << len(_DIFF_FIELDS))]
+        results: list[tuple[MatchColor, list[DiffNote]]] = [(MatchColor.GREEN, [])] * len(self.pairs)
+        for k, code in zip(np.flatnonzero(codes).tolist(), codes[codes != 0].tolist()):
+            jdr, ins = self.pairs[k]
+            results[k] = (MatchColor.ORANGE, [
+                DiffNote(field=name, jdr_value=str(getattr(jdr, name) or ""), ins_value=str(getattr(ins, name) or ""))
+                for name in fields_for[code]
+            ])
+        return results
+
+
+def classify_pairs(
+    pairs: list[tuple[ExtractedLineItem, ExtractedLineItem]],
+    tolerances: dict[str, float] = PAIR_TOLERANCES,
+) -> list[tuple[MatchColor, list[DiffNote]]]:
+    """``_classify_pair`` for many (JDR, insurance) pairs at once (see ``PairColumns``)."""
+    return PairColumns.from_pairs(pairs).classify(tolerances)
+
+
+def _format_item(item: ExtractedLineItem) -> str:
+    qty = f"{item.quantity}" if item.quantity is not None else "?"
+    unit = item.unit or "?"
+    price = f"${item.unit_price}" if item.unit_price is not None else "$?"
+    return f"{item.description} | qty={qty} {unit} | price={price}"
 
-    user_msg = (
+
+def _format_item_list(items: list[ExtractedLineItem]) -> str:
+    return "\n".join(f"  [{i}] {_format_item(item)}" for i, item in enumerate(items))
+
+
+def _matching_message(jdr_items: list[ExtractedLineItem], ins_items: list[ExtractedLineItem]) -> str:
+    return (
         f"JDR items ({len(jdr_items)}):\n{_format_item_list(jdr_items)}\n\n"
         f"Insurance items ({len(ins_items)}):\n{_format_item_list(ins_items)}"
     )
-    result = chat(MATCHING_PROMPT, user_msg, _RoomMatches)
 
-    matched_pairs: list[MatchedPair] = []
-    matched_jdr_idx: set[int] = set()
-    matched_ins_idx: set[int] = set()
 
-    for m in result.matches:
+def _valid_matches(matches: list[_ItemMatch], n_jdr: int, n_ins: int) -> list[tuple[int, int]]:
+    """In-range (jdr, ins) index pairs, first occurrence of each index only."""
+    pairs: list[tuple[int, int]] = []
+    seen_jdr: set[int] = set()
+    seen_ins: set[int] = set()
+    for m in matches:
         if (
-            0 <= m.jdr_index < len(jdr_items)
-            and 0 <= m.ins_index < len(ins_items)
-            and m.jdr_index not in matched_jdr_idx
-            and m.ins_index not in matched_ins_idx
+            0 <= m.jdr_index < n_jdr
+            and 0 <= m.ins_index < n_ins
+            and m.jdr_index not in seen_jdr
+            and m.ins_index not in seen_ins
         ):
-            color, diffs = _classify_pair(jdr_items[m.jdr_index], ins_items[m.ins_index])
-            matched_pairs.append(MatchedPair(
-                jdr_item=jdr_items[m.jdr_index],
-                ins_item=ins_items[m.ins_index],
-                color=color,
-                diff_notes=diffs,
-            ))
-            matched_jdr_idx.add(m.jdr_index)
-            matched_ins_idx.add(m.ins_index)
+            pairs.append((m.jdr_index, m.ins_index))
+            seen_jdr.add(m.jdr_index)
+            seen_ins.add(m.ins_index)
+    return pairs
+
 
+def _prematch(
+    jdr_items: list[ExtractedLineItem],
+    ins_items: list[ExtractedLineItem],
+    threshold: float,
+) -> list[tuple[int, int]]:
+    """High-confidence (jdr, insurance) index pairs that can skip the LLM.
+
+    A pair is committed when its descriptions score at least ``threshold``,
+    the units agree, and each item's score for the other beats every other
+    candidate in its row and column by ``_PREMATCH_MARGIN``. Duplicate lines
+    (the same description twice on a side) therefore stay with the LLM.
+    """
+    scores = similarity_matrix([item.description for item in jdr_items], [item.description for item in ins_items])
+    jdr_units = np.array([(item.unit or "").strip().upper() for item in jdr_items])
+    ins_units = np.array([(item.unit or "").strip().upper() for item in ins_items])
+    scores = np.where(jdr_units[:, None] == ins_units[None, :], scores, 0.0)
+
+    best_ins = scores.argmax(axis=1)
+    best_jdr = scores.argmax(axis=0)
+    # Runner-up score in each row and column (0 when there is no other candidate)
+    row_second = np.sort(scores, axis=1)[:, -2] if scores.shape[1] > 1 else np.zeros(len(jdr_items))
+    col_second = np.sort(scores, axis=0)[-2, :] if scores.shape[0] > 1 else np.zeros(len(ins_items))
+
+    pairs = []
+    for i, j in enumerate(best_ins):
+        score = scores[i, j]
+        if (
+            score >= threshold
+            and best_jdr[j] == i
+            and score - row_second[i] >= _PREMATCH_MARGIN
+            and score - col_second[j] >= _PREMATCH_MARGIN
+        ):
+            pairs.append((i, int(j)))
+    return pairs
+
+
+def _plan_match_blocks(
+    jdr_items: list[ExtractedLineItem],
+    ins_items: list[ExtractedLineItem],
+    block_size: int,
+) -> list[tuple[list[int], list[int]]]:
+    """Split an oversized room into (jdr indices, insurance indices) candidate blocks.
+
+    JDR items are cut into contiguous runs (estimates list a room's items
+    grouped by trade, so a run stays within a few subsections). Each
+    insurance item joins the block holding its most similar JDR item, plus
+    the runner-up block when that is nearly as close. Blocks take at most
+    ``_BLOCK_SLACK`` times an even share of the insurance items. Items
+    with no word in common with any JDR item go to the least loaded block.
+    """
+    n_blocks = min(len(jdr_items), math.ceil(max(len(jdr_items), len(ins_items)) / block_size))
+    bounds = [round(k * len(jdr_items) / n_blocks) for k in range(n_blocks + 1)]
+    jdr_blocks = [list(range(bounds[k], bounds[k + 1])) for k in range(n_blocks)]
+    capacity = math.ceil(_BLOCK_SLACK * len(ins_items) / n_blocks)
+
+    jdr_tokens = [tokens(item.description) for item in jdr_items]
+    ins_tokens = [tokens(item.description) for item in ins_items]
+    sim = Similarity(jdr_tokens + ins_tokens)
+    scores = [
+        [max(sim(ins_tokens[j], jdr_tokens[i]) for i in block) for block in jdr_blocks]
+        for j in range(len(ins_items))
+    ]
+
+    ins_blocks: list[list[int]] = [[] for _ in range(n_blocks)]
+    # Most confident items first, so capacity goes to the clearest placements
+    for j in sorted(range(len(ins_items)), key=lambda j: -max(scores[j])):
+        ranked = sorted(range(n_blocks), key=lambda k: (-scores[j][k], len(ins_blocks[k])))
+        open_blocks = [k for k in ranked if len(ins_blocks[k]) < capacity] or ranked
+        best = open_blocks[0]
+        if scores[j][best] == 0:
+            best = min(open_blocks, key=lambda k: len(ins_blocks[k]))
+        ins_blocks[best].append(j)
+        for k in open_blocks[1:_MAX_BLOCKS_PER_ITEM]:
+            if scores[j][k] > 0 and scores[j][k] >= _BLOCK_OVERLAP * scores[j][best]:
+                ins_blocks[k].append(j)
+
+    blocks = []
+    for jdr_idx, ins_idx in zip(jdr_blocks, ins_blocks):
+        if ins_idx:
+            blocks.append((jdr_idx, sorted(ins_idx)))
+    return blocks
+
+
+def _match_chunked(
+    jdr_items: list[ExtractedLineItem],
+    ins_items: list[ExtractedLineItem],
+    block_size: int,
+) -> list[tuple[int, int]]:
+    """Match an oversized room block by block (concurrently) and reconcile the results.
+
+    JDR blocks are disjoint, so a conflict can only be an insurance item
+    that sits in several blocks and was matched in more than one. It goes
+    to the JDR item whose description is lexically closest. The losing JDR
+    items are then re-matched against their block's still-unmatched
+    insurance items, for up to ``_RECONCILE_ROUNDS`` more rounds.
+    """
+    sim = Similarity(tokens(item.description) for item in jdr_items + ins_items)
+    pending = _plan_match_blocks(jdr_items, ins_items, block_size)
+    matched: dict[int, int] = {}  # ins index -> JDR index
+    for _ in range(1 + _RECONCILE_ROUNDS):
+        responses = chat_many(
+            MATCHING_PROMPT,
+            [_matching_message([jdr_items[i] for i in jdr_idx], [ins_items[j] for j in ins_idx])
+             for jdr_idx, ins_idx in pending],
+            _RoomMatches,
+            stage="match",
+        )
+        proposals: dict[int, list[tuple[int, int]]] = {}  # ins index -> [(JDR index, block)]
+        for b, ((jdr_idx, ins_idx), response) in enumerate(zip(pending, responses)):
+            for i, j in _valid_matches(response.matches, len(jdr_idx), len(ins_idx)):
+                proposals.setdefault(ins_idx[j], []).append((jdr_idx[i], b))
+
+        losers: dict[int, list[int]] = {}  # block -> JDR indices that lost a conflict
+        for j, candidates in proposals.items():
+            ins_tokens = tokens(ins_items[j].description)
+            candidates.sort(key=lambda c: -sim(tokens(jdr_items[c[0]].description), ins_tokens))
+            matched[j] = candidates[0][0]
+            for i, b in candidates[1:]:
+                losers.setdefault(b, []).append(i)
+
+        blocks, pending = pending, []
+        for b, jdr_idx in sorted(losers.items()):
+            free = [j for j in blocks[b][1] if j not in matched]
+            if free:
+                pending.append((sorted(jdr_idx), free))
+        if not pending:
+            break
+    return sorted((i, j) for j, i in matched.items())
+
+
+def _match_room_pairs(jdr_items: list[ExtractedLineItem], ins_items: list[ExtractedLineItem]) -> list[tuple[int, int]]:
+    """Sorted (JDR, insurance) index pairs matched within one room."""
+    if not jdr_items or not ins_items:
+        return []
+
+    pairs = _prematch(jdr_items, ins_items, PREMATCH_THRESHOLD) if PREMATCH_THRESHOLD > 0 else []
+    # Only the residual items go to the LLM; indices are mapped back afterwards
+    prematched_jdr = {i for i, _ in pairs}
+    prematched_ins = {j for _, j in pairs}
+    jdr_rest = [i for i in range(len(jdr_items)) if i not in prematched_jdr]
+    ins_rest = [j for j in range(len(ins_items)) if j not in prematched_ins]
+    if jdr_rest and ins_rest:
+        jdr_sub = [jdr_items[i] for i in jdr_rest]
+        ins_sub = [ins_items[j] for j in ins_rest]
+        if MATCH_CHUNK_ITEMS and max(len(jdr_sub), len(ins_sub)) > MATCH_CHUNK_ITEMS:
+            sub_pairs = _match_chunked(jdr_sub, ins_sub, MATCH_CHUNK_ITEMS)
+        else:
+            result = chat(MATCHING_PROMPT, _matching_message(jdr_sub, ins_sub), _RoomMatches, stage="match")
+            sub_pairs = _valid_matches(result.matches, len(jdr_sub), len(ins_sub))
+        pairs += [(jdr_rest[i], ins_rest[j]) for i, j in sub_pairs]
+    pairs.sort()
+    return pairs
+
+
+def _split_room_items(
+    jdr_items: list[ExtractedLineItem],
+    ins_items: list[ExtractedLineItem],
+    pairs: list[tuple[int, int]],
+) -> tuple[list[MatchedPair], list[ExtractedLineItem], list[ExtractedLineItem]]:
+    """Classified matches plus the unmatched items on each side, from index pairs."""
+    matched_pairs: list[MatchedPair] = []
+    for i, j in pairs:
+        color, diffs = _classify_pair(jdr_items[i], ins_items[j])
+        matched_pairs.append(MatchedPair(
+            jdr_item=jdr_items[i],
+            ins_item=ins_items[j],
+            color=color,
+            diff_notes=diffs,
+        ))
+
+    matched_jdr_idx = {i for i, _ in pairs}
+    matched_ins_idx = {j for _, j in pairs}
     unmatched_jdr = [item for i, item in enumerate(jdr_items) if i not in matched_jdr_idx]
     unmatched_ins = [item for j, item in enumerate(ins_items) if j not in matched_ins_idx]
 
     return matched_pairs, unmatched_jdr, unmatched_ins
 
 
-def compare_documents(jdr: ParsedDocument, ins: ParsedDocument) -> ComparisonResult:
+def _cross_room_message(
+    jdr_items: list[ExtractedLineItem],
+    jdr_rooms: list[str],
+    candidates: list[list[int]],
+    ins_items: list[ExtractedLineItem],
+    ins_rooms: list[str],
+) -> str:
+    blocks = []
+    for i, (item, room, cands) in enumerate(zip(jdr_items, jdr_rooms, candidates)):
+        lines = [f"JDR [{i}] ({room}): {_format_item(item)}"]
+        lines += [
+            f"  Insurance [{j}] ({ins_rooms[j]}): {_format_item(ins_items[j])}"
+            for j in cands
+        ]
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def _match_cross_room(comparisons: list[RoomComparison], k: int) -> None:
+    """Match leftover JDR items to unmatched insurance items filed under other rooms.
+
+    Every insurance item goes into one ``CandidateIndex``; each unmatched
+    JDR item looks up its ``k`` nearest unmatched insurance items from
+    other rooms, and only those small candidate sets are sent to the LLM.
+    Confirmed pairs move into the JDR item's room with a ``room`` diff
+    note. An insurance item confirmed for several JDR items goes to the
+    most similar one; the others are offered fresh candidates for up to
+    ``_RECONCILE_ROUNDS`` more rounds.
+    """
+    ins_items: list[ExtractedLineItem] = []
+    ins_owner: list[int] = []
+    available: list[bool] = []
+    for c, room in enumerate(comparisons):
+        for item in [pair.ins_item for pair in room.matched] + room.unmatched_ins:
+            ins_items.append(item)
+            ins_owner.append(c)
+        available += [False] * len(room.matched) + [True] * len(room.unmatched_ins)
+    leftovers = [(c, item) for c, room in enumerate(comparisons) for item in room.unmatched_jdr]
+    if not leftovers or not any(available):
+        return
+
+    index = CandidateIndex([item.description for item in ins_items])
+    owner = np.array(ins_owner)
+    available_mask = np.array(available)
+    jdr_rooms = [room.jdr_room or room.ins_room or "" for room in comparisons]
+    ins_rooms = [room.ins_room or room.jdr_room or "" for room in comparisons]
+
+    confirmed: dict[int, tuple[int, ExtractedLineItem]] = {}  # ins index -> (room index, JDR item)
+    pending = leftovers
+    for _ in range(1 + _RECONCILE_ROUNDS):
+        queries = []  # (room index, JDR item, [(insurance index, score)])
+        for c, item in pending:
+            found = index.top_k(item.description, k, available_mask & (owner != c), _CROSS_ROOM_MIN_SCORE)
+            if found:
+                queries.append((c, item, found))
+        if not queries:
+            break
+
+        batches = [queries[b:b + _CROSS_ROOM_BATCH] for b in range(0, len(queries), _CROSS_ROOM_BATCH)]
+        messages = []
+        batch_candidates = []  # per batch: insurance indices in prompt order
+        for batch in batches:
+            order = sorted({j for _, _, found in batch for j, _ in found})
+            local = {j: n for n, j in enumerate(order)}
+            batch_candidates.append(order)
+            messages.append(_cross_room_message(
+                [item for _, item, _ in batch],
+                [jdr_rooms[c] for c, _, _ in batch],
+                [[local[j] for j, _ in found] for _, _, found in batch],
+                [ins_items[j] for j in order],
+                [ins_rooms[ins_owner[j]] for j in order],
+            ))
+        responses = chat_many(CROSS_ROOM_PROMPT, messages, _RoomMatches, stage="cross-room")
+
+        proposals: dict[int, list[tuple[float, int, ExtractedLineItem]]] = {}  # ins index -> [(score, room, JDR item)]
+        for batch, order, response in zip(batches, batch_candidates, responses):
+            for i, j in _valid_matches(response.matches, len(batch), len(order)):
+                c, item, found = batch[i]
+                score = dict(found).get(order[j])
+                if score is not None:  # ignore insurance items not offered for this JDR item
+                    proposals.setdefault(order[j], []).append((score, c, item))
+
+        # Items that lost a conflict look again, without the insurance items taken this round
+        pending = []
+        for j, candidates in proposals.items():
+            candidates.sort(key=lambda cand: -cand[0])
+            confirmed[j] = candidates[0][1:]
+            available_mask[j] = False
+            pending += [(c, item) for _, c, item in candidates[1:]]
+        if not pending:
+            break
+
+    for j, (c, jdr_item) in sorted(confirmed.items()):
+        ins_item, source = ins_items[j], comparisons[ins_owner[j]]
+        _, diffs = _classify_pair(jdr_item, ins_item)
+        diffs.insert(0, DiffNote(field="room", jdr_value=jdr_rooms[c], ins_value=ins_rooms[ins_owner[j]]))
+        room = comparisons[c]
+        room.matched.append(MatchedPair(jdr_item=jdr_item, ins_item=ins_item, color=MatchColor.ORANGE, diff_notes=diffs))
+        room.unmatched_jdr = [item for item in room.unmatched_jdr if item is not jdr_item]
+        source.unmatched_ins = [item for item in source.unmatched_ins if item is not ins_item]
+
+
+def compare_documents(
+    jdr: ParsedDocument,
+    ins: ParsedDocument,
+    previous: ComparisonState | None = None,
+    state: ComparisonState | None = None,
+) -> ComparisonResult:
+    """Compare two parsed proposals room by room.
+
+    With ``previous`` (the ``state`` of an earlier comparison, e.g. before
+    the contractor revised the JDR), room pairs whose items are unchanged
+    on both sides reuse that comparison's matches, and only changed rooms
+    are matched again. The room mapping is reused too when both room lists
+    are unchanged. ``state``, if given, is filled in for the next revision.
+    """
+    state = state if state is not None else ComparisonState()
     jdr_room_names = [r.room_name for r in jdr.rooms]
     ins_room_names = [r.room_name for r in ins.rooms]
-    room_groups: list[RoomGroup] = map_rooms(jdr_room_names, ins_room_names)
+    if previous is not None and previous.jdr_rooms == jdr_room_names and previous.ins_rooms == ins_room_names:
+        room_groups = previous.groups
+        state.room_mapping_reused = True
+    else:
+        room_groups = map_rooms(
+            jdr_room_names,
+            ins_room_names,
+            {r.room_name: [item.description for item in r.line_items] for r in jdr.rooms},
+            {r.room_name: [item.description for item in r.line_items] for r in ins.rooms},
+        )
 
     jdr_rooms = {r.room_name: r for r in jdr.rooms}
     ins_rooms = {r.room_name: r for r in ins.rooms}
+    previous_pairs = previous.room_pairs if previous is not None else {}
 
-    def _process_group(group: RoomGroup) -> RoomComparison:
+    def _process_group(group: RoomGroup) -> tuple[RoomComparison, RoomKey, list[tuple[int, int]], bool]:
         group_jdr_items: list[ExtractedLineItem] = []
         if group.jdr_room and group.jdr_room in jdr_rooms:
             group_jdr_items = list(jdr_rooms[group.jdr_room].line_items)
@@ -138,16 +628,30 @@ def compare_documents(jdr: ParsedDocument, ins: ParsedDocument) -> ComparisonRes
         if group.ins_room and group.ins_room in ins_rooms:
             group_ins_items = list(ins_rooms[group.ins_room].line_items)
 
-        matched, unmatched_jdr, unmatched_ins = _match_room_items(group_jdr_items, group_ins_items)
+        key = (group.jdr_room, group.ins_room, _items_hash(group_jdr_items), _items_hash(group_ins_items))
+        reused = key in previous_pairs
+        # Reused pairs are indices, so they attach to this revision's items (page numbers, bboxes)
+        pairs = previous_pairs[key] if reused else _match_room_pairs(group_jdr_items, group_ins_items)
+        matched, unmatched_jdr, unmatched_ins = _split_room_items(group_jdr_items, group_ins_items, pairs)
 
-        return RoomComparison(
+        comparison = RoomComparison(
             jdr_room=group.jdr_room,
             ins_room=group.ins_room,
             matched=matched,
             unmatched_jdr=unmatched_jdr,
             unmatched_ins=unmatched_ins,
         )
+        return comparison, key, pairs, reused
+
+    processed = list(llm_map(_process_group, room_groups))
+    comparisons = [comparison for comparison, _, _, _ in processed]
+
+    state.jdr_rooms, state.ins_rooms, state.groups = jdr_room_names, ins_room_names, list(room_groups)
+    state.room_pairs = {key: pairs for _, key, pairs, _ in processed}
+    state.reused_rooms = sum(reused for _, _, _, reused in processed)
+    state.matched_rooms = len(processed) - state.reused_rooms
 
-    comparisons = list(_LLM_POOL.map(_process_group, room_groups))
+    if CROSS_ROOM_CANDIDATES > 0:
+        _match_cross_room(comparisons, CROSS_ROOM_CANDIDATES)
 
     return ComparisonResult(rooms=comparisons)
@@ -0,0 +1,122 @@
+"""Content-addressed on-disk cache for per-page LLM results.
+
+Pages are keyed by a hash of their content stream and text layer (plus the
+prompt that produced the result), so re-submitting the same or a partially
+revised PDF only pays LLM calls for the pages that actually changed.
+Entries are JSON files; the least recently used ones are evicted once the
+cache directory grows past ``PAGE_CACHE_MAX_BYTES``.
+"""
+
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import TypeVar
+
+import fitz
+from pydantic import BaseModel
+
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", ".page_cache")
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+T = TypeVar("T", bound=BaseModel)
+
+
+def page_fingerprint(page: fitz.Page, text: str) -> str:
+    """Hash a page's raw content stream together with its extracted text."""
+    h = hashlib.sha256()
+    h.update(page.read_contents())
+    h.update(b"\0")
+    h.update(text.encode())
+    return h.hexdigest()
+
+
+class PageCache:
+    """Thread-safe JSON-file cache keyed by (kind, prompt, page fingerprint)."""
+
+    def __init__(self, root: str | os.PathLike, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: int | None = None  # lazily computed total size on disk
+
+    def _path(self, kind: str, prompt: str, fingerprint: str) -> Path:
+        key = hashlib.sha256(f"{kind}\0{prompt}\0{fingerprint}".encode()).hexdigest()
+        return self.root / kind / f"{key}.json"
+
+    def get(self, kind: str, prompt: str, fingerprint: str, model: type[T]) -> T | None:
+        path = self._path(kind, prompt, fingerprint)
+        try:
+            data = path.read_text()
+        except OSError:
+            return None
+        try:
+            value = model.model_validate_json(data)
+        except ValueError:
+            # Stale schema or a torn write — treat as a miss
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)  # bump recency for LRU eviction
+        except OSError:
+            pass
+        return value
+
+    def put(self, kind: str, prompt: str, fingerprint: str, value: BaseModel) -> None:
+        path = self._path(kind, prompt, fingerprint)
+        data = value.model_dump_json().encode()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        with self._lock:
+            try:
+                old = path.stat().st_size  # overwriting an entry replaces its size
+            except OSError:
+                old = 0
+            os.replace(tmp, path)
+            if self._size is None:
+                self._size = self._disk_size()
+            else:
+                self._size += len(data) - old
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        for p in self.root.glob("*/*.json"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        return entries
+
+    def _disk_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until under 90% of the budget."""
+        entries = sorted(self._entries())
+        size = sum(s for _, s, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, s, p in entries:
+            if size <= target:
+                break
+            p.unlink(missing_ok=True)
+            size -= s
+        self._size = size
+
+
+_default_cache: PageCache | None = None
+_default_cache_lock = threading.Lock()
+
+
+def get_page_cache() -> PageCache | None:
+    """Return the process-wide page cache, or None if disabled (empty ``PAGE_CACHE_DIR``)."""
+    global _default_cache
+    if not PAGE_CACHE_DIR:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = PageCache(PAGE_CACHE_DIR)
+    return _default_cache
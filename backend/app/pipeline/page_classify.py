@@ -0,0 +1,42 @@
+"""Local page-type classification, used to skip room-split calls on pages
+that cannot contain line items.
+
+Every Xactimate line-item page repeats the table header row (DESCRIPTION /
+QTY / REPLACE / TOTAL or QUANTITY / UNIT PRICE / RCV) and has numbered item
+rows. Cover pages, summaries and photo sheets have neither, or are mostly
+covered by images. Only pages that are clearly not line-item pages are
+skipped. Anything ambiguous (numbered rows without a header, say) still
+goes to the LLM.
+"""
+
+import fitz
+
+from .text_extract import group_rows, header_columns, line_number
+
+LINE_ITEMS = "line_items"
+OTHER = "other"
+UNCERTAIN = "uncertain"
+
+# Pages at least this much covered by images are photo sheets unless they have a table header
+_PHOTO_COVERAGE = 0.5
+
+
+def image_coverage(page: fitz.Page) -> float:
+    """Fraction of the page area covered by images (overlaps counted twice, capped at 1)."""
+    area = abs(page.rect)
+    if not area:
+        return 0.0
+    covered = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    return min(1.0, covered / area)
+
+
+def classify_page(page: fitz.Page) -> str:
+    """Label ``page`` as ``LINE_ITEMS``, ``OTHER`` or ``UNCERTAIN``."""
+    rows = group_rows(page.get_text("words"))
+    has_header = any(header_columns(row) is not None for row in rows)
+    numbered = sum(1 for row in rows if line_number(row) is not None)
+    if has_header:
+        return LINE_ITEMS if numbered else UNCERTAIN
+    if numbered == 0 or image_coverage(page) >= _PHOTO_COVERAGE:
+        return OTHER
+    return UNCERTAIN
@@ -1,15 +1,68 @@
-import base64
+import os
 import re
+import threading
 from collections.abc import Callable
-from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Literal, NamedTuple
 
 import fitz
 from pydantic import BaseModel
 
-from ..llm import chat, vision_extract
+from ..llm import chat, chat_many, llm_map, vision_extract
 from ..schemas import Bbox, ExtractedLineItem, ExtractedRoom, LineItemBboxes, ParsedDocument
-
-_LLM_POOL = ThreadPoolExecutor(max_workers=8)
+from .assignment import IntervalSet, min_cost_assignment
+from .page_cache import PageCache, get_page_cache, page_fingerprint
+from .page_classify import OTHER, UNCERTAIN, classify_page
+from .render import (
+    DEFAULT_IMAGE_OPTIONS, ImageOptions, RenderPool, get_render_pool, render_page, to_data_url, worker_doc,
+)
+from .text_extract import extract_text_items
+from .validate import check_page_items, numbered_rows
+
+# fitz is not thread-safe, and both documents of a job are parsed at once: every
+# in-process Document/Page call in this module (open, text, fingerprints,
+# classification, rendering, validation, bbox location, close) holds this lock
+_FITZ_LOCK = threading.Lock()
+
+
+@dataclass
+class ParseStats:
+    """Per-document counters reported alongside a job (updated from worker threads)."""
+    room_cache_hits: int = 0  # page cache, room-split results
+    room_cache_misses: int = 0
+    items_cache_hits: int = 0  # page cache, extracted line items
+    items_cache_misses: int = 0
+    text_pages: int = 0
+    vision_pages: int = 0
+    room_split_requests: int = 0
+    room_split_skipped: int = 0  # pages the local classifier ruled out without an LLM call
+    fast_pages: int = 0  # tiered extraction: pages the text model's items were kept for
+    escalated_pages: int = 0  # tiered extraction: pages sent on to the vision model
+    escalations: dict[int, list[str]] = field(default_factory=dict)  # page number -> failed checks
+    page_types: dict[int, str] = field(default_factory=dict)  # page number -> page_classify label
+    payload_bytes: dict[int, int] = field(default_factory=dict)  # page number -> image data URL size
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def record_page_type(self, page_number: int, label: str) -> None:
+        with self._lock:
+            self.page_types[page_number] = label
+
+    def record_payload(self, page_number: int, n_bytes: int) -> None:
+        with self._lock:
+            self.payload_bytes[page_number] = n_bytes
+
+    def record_escalation(self, page_number: int, reasons: list[str]) -> None:
+        with self._lock:
+            self.escalated_pages += 1
+            self.escalations[page_number] = reasons
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {k: (dict(v) if isinstance(v, dict) else v) for k, v in vars(self).items() if not k.startswith("_")}
 
 
 # --- LLM response models ---
@@ -23,6 +76,15 @@ class _PageRooms(BaseModel):
     rooms: list[_RoomSection]
 
 
+class _BatchPage(BaseModel):
+    page: int
+    rooms: list[_RoomSection]
+
+
+class _BatchRooms(BaseModel):
+    pages: list[_BatchPage]
+
+
 class _LLMLineItem(BaseModel):
     description: str
     quantity: float | None = None
@@ -52,6 +114,12 @@ Rules:
 - Pages with photos/images of damage, documentation photos, or photo captions are NOT line item pages. Return an empty list for these.
 - A line item page has a structured table with columns like DESCRIPTION, QTY, REPLACE, TOTAL (or QUANTITY, UNIT PRICE, RCV). If you don't see this table structure, return an empty list."""
 
+ROOM_SPLIT_BATCH_PROMPT = ROOM_SPLIT_PROMPT + """
+
+The input contains several consecutive pages of the same proposal. Each page starts with a line "=== PAGE <n> ===".
+Return one entry per page, in order, with page set to <n> and rooms following the rules above for that page alone.
+A room that carries over from the previous page (including a page earlier in this input) keeps the same room_name and has is_continuation true."""
+
 EXTRACTION_PROMPT_TEMPLATE = """\
 Extract all line items from this Xactimate PDF proposal page.
 The rooms on this page are: {rooms}
@@ -69,12 +137,16 @@ Rules:
 - Some insurance formats show quantity and unit price on a separate line below the description. Combine them into one line item.
 - Items marked as "Bid Item" or "OPEN ITEM" with no pricing should still be extracted with null values for unit_price and total."""
 
+TEXT_EXTRACTION_PROMPT_TEMPLATE = EXTRACTION_PROMPT_TEMPLATE + """
+
+The page is given as its extracted text layer instead of an image. Table cells appear in reading order, \
+often one per line, so a row's description, quantity, unit and prices may be on consecutive lines."""
+
 
 # --- Helpers ---
 
-def _render_page_b64(page: fitz.Page) -> str:
-    pix = page.get_pixmap(dpi=200)
-    return base64.b64encode(pix.tobytes("png")).decode()
+def _render_page_data_url(page: fitz.Page, options: ImageOptions = DEFAULT_IMAGE_OPTIONS) -> str:
+    return to_data_url(render_page(page, options), options.mime_type)
 
 
 def _normalize(text: str) -> str:
@@ -82,23 +154,135 @@ def _normalize(text: str) -> str:
     return re.sub(r"\s+", " ", text).strip().lower()
 
 
-def _words_match(pdf_word: str, target_word: str) -> bool:
-    """Fuzzy word comparison: handles quoting, punctuation, case."""
-    a = pdf_word.lower().strip(".,;:()\"'""''")
-    b = target_word.lower().strip(".,;:()\"'""''")
+_STRIP_CHARS = ".,;:()\"'"
+_NUMBER_TOKEN_RE = re.compile(r"^\(?-?\$?(\d{1,3}(,\d{3})+|\d+)(\.\d+)?\)?$")
+# Max vertical distance between a value's row and the description's row
+_ROW_TOLERANCE = 15
+# Weight of the page-order tie-break in ``_assign_description_bboxes`` (< 1 word)
+_ORDER_WEIGHT = 0.5
+
+BBOX_ASSIGNMENT = os.getenv("BBOX_ASSIGNMENT", "global")  # global | greedy
+
+# Room split sends runs of consecutive pages in one request, up to this many
+# (estimated) input tokens; 0 sends one request per page
+ROOM_SPLIT_BATCH_TOKENS = int(os.getenv("ROOM_SPLIT_BATCH_TOKENS", "6000"))
+_CHARS_PER_TOKEN = 4
+_PAGE_DELIMITER_TOKENS = 10
+
+# Tiered extraction: pages the text-layer parser rejects are first read from
+# their text by the cheaper text model, and only go to the vision model when
+# that result fails the checks in ``validate.py``
+TIERED_EXTRACTION = os.getenv("TIERED_EXTRACTION", "0") == "1"
+EXTRACTION_FAST_MODEL = os.getenv("EXTRACTION_FAST_MODEL", "fast-production")
+_QUOTES = str.maketrans({"\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'"})
+
+
+def _norm_word(word: str) -> str:
+    """Normalize a single word for ``_words_match``: lowercase, strip punctuation edges, straighten quotes."""
+    return word.lower().strip(_STRIP_CHARS).translate(_QUOTES)
+
+
+def _tokens_match(a: str, b: str) -> bool:
+    """``_words_match`` for words already passed through ``_norm_word``."""
     if not a or not b:
         return False
     if a == b:
         return True
-    # Handle curly-quote ↔ straight-quote, fraction chars, etc.
-    a_norm = a.replace("\u201c", '"').replace("\u201d", '"').replace("\u2018", "'").replace("\u2019", "'")
-    b_norm = b.replace("\u201c", '"').replace("\u201d", '"').replace("\u2018", "'").replace("\u2019", "'")
-    if a_norm == b_norm:
-        return True
     # One is a prefix of the other (handles truncated or merged words)
-    if len(a) >= 3 and len(b) >= 3 and (a.startswith(b) or b.startswith(a)):
-        return True
-    return False
+    return len(a) >= 3 and len(b) >= 3 and (a.startswith(b) or b.startswith(a))
+
+
+def _words_match(pdf_word: str, target_word: str) -> bool:
+    """Fuzzy word comparison: handles quoting, punctuation, case."""
+    return _tokens_match(_norm_word(pdf_word), _norm_word(target_word))
+
+
+def _number_value(word: str) -> float | None:
+    """Parse a numeric page token ("1,234.50", "(12.00)", "$5") to a 2-dp float, else None."""
+    if not _NUMBER_TOKEN_RE.match(word):
+        return None
+    value = float(word.strip("()").replace("$", "").replace(",", ""))
+    return round(-value if word.startswith("(") else value, 2)
+
+
+class _PageIndex:
+    """Word lookup for one page, built once and shared by every item located on it.
+
+    Holds ``page.get_text("words")`` with each word pre-normalized, plus an
+    inverted index from normalized token (and from its first three
+    characters, for the prefix rule in ``_tokens_match``) to word
+    positions, so description matching only starts at plausible words.
+
+    Numeric and unit tokens are also indexed by (parsed value, row bucket)
+    so quantity/price/total/unit lookups are dictionary hits on the
+    description's row rather than ``page.search_for`` scans of the page.
+    """
+
+    def __init__(self, page: fitz.Page):
+        self.page = page
+        self.words = page.get_text("words")
+        # Each word: (x0, y0, x1, y1, "text", block_no, line_no, word_no)
+        self.tokens = [_norm_word(w[4]) for w in self.words]
+        self._by_token: dict[str, list[int]] = {}
+        self._by_prefix: dict[str, list[int]] = {}
+        for i, tok in enumerate(self.tokens):
+            if not tok:
+                continue
+            self._by_token.setdefault(tok, []).append(i)
+            if len(tok) >= 3:
+                self._by_prefix.setdefault(tok[:3], []).append(i)
+
+        self._numbers: dict[tuple[float, int], list[int]] = {}
+        self._units: dict[tuple[str, int], list[int]] = {}
+        for i, w in enumerate(self.words):
+            row = self._row(w)
+            value = _number_value(w[4])
+            if value is not None:
+                self._numbers.setdefault((value, row), []).append(i)
+            elif w[4].isalpha():
+                self._units.setdefault((w[4].upper(), row), []).append(i)
+
+    @staticmethod
+    def _row(word) -> int:
+        return int((word[1] + word[3]) / 2 // _ROW_TOLERANCE)
+
+    def _on_row(self, table: dict, key, y_mid: float) -> Bbox | None:
+        """Best word under ``key`` within ``_ROW_TOLERANCE`` of ``y_mid``.
+
+        Like the ``search_for`` variants this replaces, tokens written with
+        decimals ("1.00") win over bare integers ("1"), then page order.
+        """
+        row = int(y_mid // _ROW_TOLERANCE)
+        hits = [
+            i
+            for r in (row - 1, row, row + 1)
+            for i in table.get((key, r), ())
+            if abs((self.words[i][1] + self.words[i][3]) / 2 - y_mid) < _ROW_TOLERANCE
+        ]
+        if not hits:
+            return None
+        w = self.words[min(hits, key=lambda i: ("." not in self.words[i][4], i))]
+        return (w[0], w[1], w[2], w[3])
+
+    def find_number(self, value: float, y_mid: float) -> Bbox | None:
+        return self._on_row(self._numbers, round(value, 2), y_mid)
+
+    def find_unit(self, unit: str, y_mid: float) -> Bbox | None:
+        return self._on_row(self._units, unit.strip().upper(), y_mid)
+
+    def positions(self, token: str) -> list[int]:
+        """Ascending positions of page words that ``_tokens_match`` ``token``."""
+        if not token:
+            return []
+        if len(token) < 3:
+            return self._by_token.get(token, [])
+        # Words of 3+ chars sharing a prefix relation always share their first 3 chars
+        hits = {
+            i for i in self._by_prefix.get(token[:3], ())
+            if self.tokens[i].startswith(token) or token.startswith(self.tokens[i])
+        }
+        hits.update(self._by_token.get(token, ()))
+        return sorted(hits)
 
 
 def _overlaps_claimed(bbox: Bbox, claimed: list[Bbox]) -> bool:
@@ -110,49 +294,34 @@ def _overlaps_claimed(bbox: Bbox, claimed: list[Bbox]) -> bool:
     return False
 
 
-def _find_description_bbox(
-    page: fitz.Page, description: str, claimed: list[Bbox] | None = None,
-) -> Bbox | None:
-    """Find the full description text using word-level matching.
-
-    Uses get_text("words") to match the description word-by-word,
-    then returns the union bbox covering all matched words (handles
-    multi-line descriptions naturally).
+def _description_spans(description: str, index: _PageIndex) -> list[tuple[int, Bbox]]:
+    """Candidate placements of ``description`` on the page, in page order.
 
-    ``claimed`` is a list of bboxes already assigned to other items on
-    this page — matches that overlap a claimed region are skipped so
-    that each item highlights a unique location.
+    Returns ``(matched word count, union bbox)`` for every start word
+    where at least half of the description's words match in sequence.
     """
-    if claimed is None:
-        claimed = []
-
     text = re.sub(r"^\d+\.\s*", "", description)
     target_words = text.split()
     if not target_words:
-        return None
+        return []
 
-    page_words = page.get_text("words")
-    # Each word: (x0, y0, x1, y1, "text", block_no, line_no, word_no)
+    targets = [_norm_word(w) for w in target_words]
+    page_words = index.words
+    tokens = index.tokens
 
     min_match = max(2, len(target_words) // 2)
-    best_match: list[tuple] = []
-    best_count = 0
-
-    for i in range(len(page_words)):
-        pw = page_words[i][4]
-        if not _words_match(pw, target_words[0]):
-            continue
+    spans: list[tuple[int, Bbox]] = []
 
+    for i in index.positions(targets[0]):
         # Try to match the word sequence starting here
         matched = [page_words[i]]
         ti = 1  # target word index
         pi = i + 1  # page word index
-        while ti < len(target_words) and pi < len(page_words):
-            pw_next = page_words[pi][4]
+        while ti < len(targets) and pi < len(page_words):
             # Skip if next page-word is too far away (different section)
             if page_words[pi][1] - page_words[pi - 1][1] > 20:
                 break
-            if _words_match(pw_next, target_words[ti]):
+            if _tokens_match(tokens[pi], targets[ti]):
                 matched.append(page_words[pi])
                 ti += 1
                 pi += 1
@@ -163,25 +332,19 @@ def _find_description_bbox(
                 if pi - (i + len(matched)) > 3:
                     break
 
-        if len(matched) > best_count and len(matched) >= min_match:
-            candidate = (
+        if len(matched) >= min_match:
+            spans.append((len(matched), (
                 min(w[0] for w in matched),
                 min(w[1] for w in matched),
                 max(w[2] for w in matched),
                 max(w[3] for w in matched),
-            )
-            if not _overlaps_claimed(candidate, claimed):
-                best_count = len(matched)
-                best_match = matched
-
-    if best_match:
-        x0 = min(w[0] for w in best_match)
-        y0 = min(w[1] for w in best_match)
-        x1 = max(w[2] for w in best_match)
-        y1 = max(w[3] for w in best_match)
-        return (x0, y0, x1, y1)
-
-    # Fallback: use search_for with progressively shorter prefixes
+            )))
+    return spans
+
+
+def _search_description(page: fitz.Page, description: str, is_free: Callable[[Bbox], bool]) -> Bbox | None:
+    """Fallback: use search_for with progressively shorter prefixes."""
+    text = re.sub(r"^\d+\.\s*", "", description)
     for length in [60, 40, 25]:
         query = text[:length].strip()
         if len(query) < 5:
@@ -189,58 +352,243 @@ def _find_description_bbox(
         results = page.search_for(query)
         for r in results:
             candidate = (r.x0, r.y0, r.x1, r.y1)
-            if not _overlaps_claimed(candidate, claimed):
+            if is_free(candidate):
                 return candidate
     return None
 
 
-def _find_number_bbox(page: fitz.Page, value: float | None, desc_bbox: Bbox | None) -> Bbox | None:
+def _find_description_bbox(
+    page: fitz.Page, description: str, claimed: list[Bbox] | None = None,
+    index: _PageIndex | None = None,
+) -> Bbox | None:
+    """Find the full description text using word-level matching.
+
+    Uses get_text("words") to match the description word-by-word,
+    then returns the union bbox covering all matched words (handles
+    multi-line descriptions naturally).
+
+    ``claimed`` is a list of bboxes already assigned to other items on
+    this page — matches that overlap a claimed region are skipped so
+    that each item highlights a unique location.
+
+    ``index`` is the page's ``_PageIndex``; pass it when locating several
+    items on the same page so the word list is only read once.
+    """
+    if claimed is None:
+        claimed = []
+    if index is None:
+        index = _PageIndex(page)
+
+    best: Bbox | None = None
+    best_count = 0
+    for count, candidate in _description_spans(description, index):
+        if count > best_count and not _overlaps_claimed(candidate, claimed):
+            best_count = count
+            best = candidate
+    if best is not None:
+        return best
+    return _search_description(page, description, lambda b: not _overlaps_claimed(b, claimed))
+
+
+def _assign_description_bboxes(
+    page: fitz.Page, descriptions: list[str], index: _PageIndex | None = None,
+) -> list[Bbox | None]:
+    """Place all descriptions on a page jointly instead of greedily in extraction order.
+
+    Every (item, candidate span) pair is scored by matched word count, with
+    a small tie-break towards spans whose position on the page agrees with
+    the item's position in the extraction order, and items are assigned to
+    spans by min-cost assignment. Distinct spans can still overlap
+    vertically, so assignments are then committed most-confident first
+    against an ``IntervalSet`` of claimed rows; an item whose span is
+    taken moves to its best free span, and items left without one fall
+    back to ``search_for``.
+    """
+    if index is None:
+        index = _PageIndex(page)
+    n = len(descriptions)
+    if n == 0:
+        return []
+    spans = [_description_spans(d, index) for d in descriptions]
+    columns: dict[Bbox, int] = {}
+    for item_spans in spans:
+        for _, bbox in item_spans:
+            columns.setdefault(bbox, len(columns))
+
+    height = page.rect.height or 1.0
+    # One extra "unplaced" column per item (cost 0); non-candidate spans cost more than that
+    cost = [[1.0] * len(columns) + [0.0] * n for _ in range(n)]
+    for k, item_spans in enumerate(spans):
+        expected = (k + 0.5) / n
+        for count, bbox in item_spans:
+            j = columns[bbox]
+            cost[k][j] = min(cost[k][j], -count + _ORDER_WEIGHT * (bbox[1] / height - expected) ** 2)
+    assigned = min_cost_assignment(cost)
+
+    by_column = {j: bbox for bbox, j in columns.items()}
+    claimed = IntervalSet()
+    results: list[Bbox | None] = [None] * n
+    for k in sorted(range(n), key=lambda k: cost[k][assigned[k]]):
+        if cost[k][assigned[k]] >= 0:
+            continue  # unplaced
+        bbox = by_column[assigned[k]]
+        if not claimed.overlaps(bbox[1], bbox[3]):
+            results[k] = bbox
+            claimed.add(bbox[1], bbox[3])
+
+    for k, description in enumerate(descriptions):
+        if results[k] is not None:
+            continue
+        free = [bbox for _, bbox in spans[k] if not claimed.overlaps(bbox[1], bbox[3])]
+        if free:
+            results[k] = min(free, key=lambda bbox: cost[k][columns[bbox]])
+        else:
+            results[k] = _search_description(page, description, lambda b: not claimed.overlaps(b[1], b[3]))
+        if results[k] is not None:
+            claimed.add(results[k][1], results[k][3])
+    return results
+
+
+def _find_number_bbox(
+    page: fitz.Page, value: float | None, desc_bbox: Bbox | None, index: _PageIndex | None = None,
+) -> Bbox | None:
     """Find a numeric value on the same row as the description."""
     if value is None or desc_bbox is None:
         return None
-    candidates = []
-    candidates.append(f"{value:,.2f}")
-    candidates.append(f"{value:.2f}")
-    if value == int(value):
-        candidates.append(f"{int(value):,}")
-        candidates.append(str(int(value)))
-    y_mid = (desc_bbox[1] + desc_bbox[3]) / 2
-    tolerance = 15
-    for text in candidates:
-        results = page.search_for(text)
-        for r in results:
-            r_mid = (r.y0 + r.y1) / 2
-            if abs(r_mid - y_mid) < tolerance:
-                return (r.x0, r.y0, r.x1, r.y1)
-    return None
+    if index is None:
+        index = _PageIndex(page)
+    return index.find_number(value, (desc_bbox[1] + desc_bbox[3]) / 2)
 
 
-def _find_unit_bbox(page: fitz.Page, unit: str | None, desc_bbox: Bbox | None) -> Bbox | None:
+def _find_unit_bbox(
+    page: fitz.Page, unit: str | None, desc_bbox: Bbox | None, index: _PageIndex | None = None,
+) -> Bbox | None:
     """Find the unit text on the same row as the description."""
     if not unit or desc_bbox is None:
         return None
-    y_mid = (desc_bbox[1] + desc_bbox[3]) / 2
-    tolerance = 15
-    results = page.search_for(unit)
-    for r in results:
-        r_mid = (r.y0 + r.y1) / 2
-        if abs(r_mid - y_mid) < tolerance:
-            return (r.x0, r.y0, r.x1, r.y1)
-    return None
+    if index is None:
+        index = _PageIndex(page)
+    return index.find_unit(unit, (desc_bbox[1] + desc_bbox[3]) / 2)
 
 
-def _locate_bboxes(page: fitz.Page, item, claimed: list[Bbox] | None = None) -> LineItemBboxes:
-    """Locate per-field bounding boxes for a line item."""
-    desc_bbox = _find_description_bbox(page, item.description, claimed)
+def _field_bboxes(page: fitz.Page, item, desc_bbox: Bbox | None, index: _PageIndex) -> LineItemBboxes:
     return LineItemBboxes(
         description=desc_bbox,
-        quantity=_find_number_bbox(page, item.quantity, desc_bbox),
-        unit_price=_find_number_bbox(page, item.unit_price, desc_bbox),
-        total=_find_number_bbox(page, item.total, desc_bbox),
-        unit=_find_unit_bbox(page, item.unit, desc_bbox),
+        quantity=_find_number_bbox(page, item.quantity, desc_bbox, index),
+        unit_price=_find_number_bbox(page, item.unit_price, desc_bbox, index),
+        total=_find_number_bbox(page, item.total, desc_bbox, index),
+        unit=_find_unit_bbox(page, item.unit, desc_bbox, index),
     )
 
 
+def _locate_bboxes(
+    page: fitz.Page, item, claimed: list[Bbox] | None = None, index: _PageIndex | None = None,
+) -> LineItemBboxes:
+    """Locate per-field bounding boxes for a line item."""
+    if index is None:
+        index = _PageIndex(page)
+    desc_bbox = _find_description_bbox(page, item.description, claimed, index)
+    return _field_bboxes(page, item, desc_bbox, index)
+
+
+def _locate_page_bboxes(page: fitz.Page, items: list, mode: str = BBOX_ASSIGNMENT) -> list[LineItemBboxes]:
+    """Locate bboxes for all line items on one page.
+
+    ``mode`` is "global" (``_assign_description_bboxes``) or "greedy"
+    (each item in extraction order takes its best unclaimed match).
+    """
+    index = _PageIndex(page)
+    if mode == "greedy":
+        located: list[LineItemBboxes] = []
+        claimed: list[Bbox] = []  # description bboxes already assigned on this page
+        for item in items:
+            bboxes = _locate_bboxes(page, item, claimed, index)
+            if bboxes.description:
+                claimed.append(bboxes.description)
+            located.append(bboxes)
+        return located
+    desc_bboxes = _assign_description_bboxes(page, [item.description for item in items], index)
+    return [_field_bboxes(page, item, desc, index) for item, desc in zip(items, desc_bboxes)]
+
+
+class _ItemFields(NamedTuple):
+    """Picklable stand-in for a line item, sent to bbox-location workers."""
+    description: str
+    quantity: float | None
+    unit: str | None
+    unit_price: float | None
+    total: float | None
+
+    @classmethod
+    def of(cls, item) -> "_ItemFields":
+        """Copy the fields bbox location uses; Decimal values (``ExtractedLineItem``) become floats."""
+        def _num(v):
+            return float(v) if v is not None else None
+        return cls(item.description, _num(item.quantity), item.unit, _num(item.unit_price), _num(item.total))
+
+
+_BBOX_FIELDS = tuple(LineItemBboxes.model_fields)
+
+
+def _locate_shard(pdf_path: str, jobs: list[tuple[int, list[_ItemFields]]], mode: str) -> list[list[tuple]]:
+    """Worker entry point: locate bboxes for whole pages using the worker's own document handle.
+
+    Each item's bboxes come back as a plain tuple in ``LineItemBboxes`` field order.
+    """
+    doc = worker_doc(pdf_path)
+    return [
+        [tuple(getattr(b, f) for f in _BBOX_FIELDS) for b in _locate_page_bboxes(doc[i], items, mode)]
+        for i, items in jobs
+    ]
+
+
+def locate_document_bboxes(
+    pdf_path: str, pages: dict[int, list], pool: RenderPool | None = None, mode: str = BBOX_ASSIGNMENT,
+) -> dict[int, list[LineItemBboxes]]:
+    """Locate bboxes for line items grouped by 0-based page index.
+
+    With a ``pool`` the pages are sharded across its worker processes;
+    otherwise they are located in-process, one page after another.
+    """
+    jobs = [(i, [_ItemFields.of(item) for item in items]) for i, items in pages.items()]
+    if pool is not None:
+        results = pool.map_shards(_locate_shard, pdf_path, jobs, mode)
+        return {
+            i: [LineItemBboxes(**dict(zip(_BBOX_FIELDS, t))) for t in located]
+            for (i, _), located in zip(jobs, results)
+        }
+    with _FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        try:
+            return {i: _locate_page_bboxes(doc[i], items, mode) for i, items in jobs}
+        finally:
+            doc.close()
+
+
+def _plan_room_batches(pages: list[int], texts: list[str], token_budget: int) -> list[list[int]]:
+    """Group ``pages`` into runs of consecutive pages whose text fits ``token_budget``.
+
+    A page that exceeds the budget on its own still gets a batch of one.
+    """
+    batches: list[list[int]] = []
+    current: list[int] = []
+    used = 0
+    for i in pages:
+        cost = len(texts[i]) // _CHARS_PER_TOKEN + _PAGE_DELIMITER_TOKENS
+        if current and (i != current[-1] + 1 or used + cost > token_budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _batch_message(pages: list[int], texts: list[str]) -> str:
+    return "\n\n".join(f"=== PAGE {i + 1} ===\n{texts[i].strip()}" for i in pages)
+
+
 # --- Main pipeline ---
 
 def parse_document(
@@ -249,64 +597,260 @@ def parse_document(
     on_step: Callable[[str], None] | None = None,
     combined_pages: int | None = None,
     page_offset: int = 0,
+    stats: ParseStats | None = None,
+    cache: PageCache | Literal["default"] | None = "default",
+    use_text_layer: bool = True,
+    classify_pages: bool = True,
+    streaming: bool = True,
+    render_pool: RenderPool | None = None,
+    image_options: ImageOptions | None = None,
+    tiered: bool = TIERED_EXTRACTION,
 ) -> ParsedDocument:
     """Parse a PDF document. Calls ``on_step(label)`` each time an LLM
     request starts so the caller can increment a shared progress counter.
     ``combined_pages`` is the total page count across all documents (for labels).
-    ``page_offset`` shifts page numbers in labels for multi-document progress."""
-    doc = fitz.open(pdf_path)
-    total_pages = len(doc)
+    ``page_offset`` shifts page numbers in labels for multi-document progress.
+    ``stats`` collects page-cache hit/miss counts; ``cache`` defaults to the
+    process-wide page cache (see ``page_cache.py``) and ``None`` disables it.
+    ``use_text_layer`` reads line items straight from the PDF text layer
+    where the page validates (see ``text_extract.py``), sending only the
+    remaining pages to the vision model.
+    ``classify_pages`` labels each page locally (see ``page_classify.py``) and
+    skips the room-split call for pages that clearly hold no line items; the
+    labels are recorded in ``stats.page_types``.
+    ``streaming`` lets each page move through room split → extraction → bbox
+    location as soon as its own previous step finishes; ``False`` restores
+    the phased mode where every stage waits for all pages.
+    ``render_pool`` renders vision pages and locates JDR bboxes in worker
+    processes; it defaults to the shared pool configured by
+    ``RENDER_WORKERS`` (in-process when unset).
+    ``image_options`` controls crop/DPI/color/format of vision images and
+    defaults to the ``VISION_IMAGE_*`` environment settings; the size of each
+    page's payload is recorded in ``stats.payload_bytes``.
+    Room split batches consecutive uncached pages into one request each, up
+    to ``ROOM_SPLIT_BATCH_TOKENS`` estimated input tokens.
+    ``tiered`` first reads pages the text-layer parser rejects with the
+    cheaper ``EXTRACTION_FAST_MODEL`` from their text, and renders and sends
+    them to the vision model only when those items fail the checks in
+    ``validate.py``; ``stats`` records how many pages were escalated and why."""
+    with _FITZ_LOCK:
+        doc = fitz.open(pdf_path)
+        total_pages = len(doc)
     label_total = combined_pages or total_pages
-
-    # Phase 1: Extract page text (PyMuPDF, fast) and room-split (text LLM)
-    page_texts = [doc[i].get_text() for i in range(total_pages)]
+    if stats is None:
+        stats = ParseStats()
+    if cache == "default":
+        cache = get_page_cache()
+    if render_pool is None:
+        render_pool = get_render_pool()
+    if image_options is None:
+        image_options = DEFAULT_IMAGE_OPTIONS
+
+    # Extract page text (PyMuPDF, fast) and content fingerprints for the page cache
+    with _FITZ_LOCK:
+        page_texts = [doc[i].get_text() for i in range(total_pages)]
+        page_keys = [page_fingerprint(doc[i], page_texts[i]) for i in range(total_pages)]
+        page_types = [classify_page(doc[i]) if classify_pages else UNCERTAIN for i in range(total_pages)]
+    if classify_pages:
+        for i, label in enumerate(page_types):
+            stats.record_page_type(i + 1, label)
+
+    # --- Per-page stages: room split → prepare (cache/text/render) → extract → locate ---
+
+    # Room-split cache lookups happen up front so the remaining pages can be batched
+    def _needs_room_split(page_idx: int) -> bool:
+        return len(page_texts[page_idx].strip()) >= 30 and page_types[page_idx] != OTHER
+
+    cached_rooms: dict[int, _PageRooms] = {}
+    if cache:
+        for i in range(total_pages):
+            if _needs_room_split(i):
+                hit = cache.get("rooms", ROOM_SPLIT_PROMPT, page_keys[i], _PageRooms)
+                if hit is not None:
+                    cached_rooms[i] = hit
+    batches: list[list[int]] = []
+    if ROOM_SPLIT_BATCH_TOKENS > 0:
+        uncached = [i for i in range(total_pages) if _needs_room_split(i) and i not in cached_rooms]
+        batches = _plan_room_batches(uncached, page_texts, ROOM_SPLIT_BATCH_TOKENS)
+    batch_of = {i: b for b, pages in enumerate(batches) for i in pages}
+    batch_locks = [threading.Lock() for _ in batches]
+    batch_results: dict[int, _PageRooms] = {}
+
+    def _split_single(page_idx: int) -> _PageRooms:
+        stats.incr("room_split_requests")
+        print(f"    [{source}] room-split page {page_idx+1}/{total_pages}", flush=True)
+        result = chat(ROOM_SPLIT_PROMPT, page_texts[page_idx].strip(), _PageRooms, stage="room-split")
+        if cache:
+            cache.put("rooms", ROOM_SPLIT_PROMPT, page_keys[page_idx], result)
+        return result
+
+    def _split_batch(b: int) -> None:
+        """Room-split every page of batch ``b`` (called once, by the first page that needs it)."""
+        pages = batches[b]
+        if len(pages) == 1:
+            batch_results[pages[0]] = _split_single(pages[0])
+            return
+        stats.incr("room_split_requests")
+        print(f"    [{source}] room-split pages {pages[0]+1}-{pages[-1]+1}/{total_pages}", flush=True)
+        response = chat(
+            ROOM_SPLIT_BATCH_PROMPT, _batch_message(pages, page_texts), _BatchRooms, stage="room-split",
+        )
+        by_page = {p.page - 1: _PageRooms(rooms=p.rooms) for p in response.pages}
+        if set(by_page) != set(pages):
+            # Page numbers that don't match the request (e.g. renumbered 1..k) can't be
+            # trusted to line up with pages, so every page of the batch is asked again
+            by_page = {}
+        for i in pages:
+            if i in by_page:
+                batch_results[i] = by_page[i]
+                if cache:
+                    cache.put("rooms", ROOM_SPLIT_PROMPT, page_keys[i], by_page[i])
+        missing = [i for i in pages if i not in by_page]
+        if missing:
+            # One concurrent round on the LLM loop, not a serial call per page under the lock
+            stats.incr("room_split_requests", len(missing))
+            print(f"    [{source}] room-split {len(missing)} pages singly after batch {pages[0]+1}-{pages[-1]+1}", flush=True)
+            singles = chat_many(
+                ROOM_SPLIT_PROMPT, [page_texts[i].strip() for i in missing], _PageRooms, stage="room-split",
+            )
+            for i, result in zip(missing, singles):
+                batch_results[i] = result
+                if cache:
+                    cache.put("rooms", ROOM_SPLIT_PROMPT, page_keys[i], result)
 
     def _room_split(page_idx: int) -> list[str]:
-        text = page_texts[page_idx].strip()
         label_page = page_offset + page_idx + 1
-        if not text or len(text) < 30:
-            if on_step:
-                on_step(f"Room split page {label_page}/{label_total}")
-            return []
         if on_step:
             on_step(f"Room split page {label_page}/{label_total}")
-        print(f"    [{source}] room-split page {page_idx+1}/{total_pages}", flush=True)
-        result = chat(ROOM_SPLIT_PROMPT, text, _PageRooms)
+        if not _needs_room_split(page_idx):
+            if page_types[page_idx] == OTHER and len(page_texts[page_idx].strip()) >= 30:
+                stats.incr("room_split_skipped")
+            return []
+        result = cached_rooms.get(page_idx)
+        if result is not None:
+            stats.incr("room_cache_hits")
+        else:
+            stats.incr("room_cache_misses")
+            if page_idx in batch_of:
+                b = batch_of[page_idx]
+                with batch_locks[b]:
+                    if page_idx not in batch_results:
+                        _split_batch(b)
+                result = batch_results[page_idx]
+            else:
+                result = _split_single(page_idx)
         return [r.room_name for r in result.rooms]
 
-    page_rooms = list(_LLM_POOL.map(_room_split, range(total_pages)))
-
-    # Phase 2: Render content pages and extract line items (vision LLM)
-    content_pages = [i for i, r in enumerate(page_rooms) if r]
-    # Only render pages that need extraction (sequential — fitz not thread-safe)
-    page_images: dict[int, str] = {i: _render_page_b64(doc[i]) for i in content_pages}
-
-    def _extract(page_idx: int) -> tuple[int, list[str], _LLMPageItems]:
-        rooms = page_rooms[page_idx]
+    def _items_key(rooms: list[str]) -> str:
+        # Image options are part of the key so payload/accuracy experiments don't share results
+        prompt = EXTRACTION_PROMPT_TEMPLATE.format(rooms=", ".join(rooms))
+        return f"{prompt}\0{image_options}"
+
+    def _fast_items_key(rooms: list[str]) -> str:
+        # Text-model results depend on the model and page text, not on how pages are rendered
+        prompt = TEXT_EXTRACTION_PROMPT_TEMPLATE.format(rooms=", ".join(rooms))
+        return f"{prompt}\0{EXTRACTION_FAST_MODEL}"
+
+    def _render(page_indices: list[int]) -> list[str]:
+        """Render pages to image data URLs for ``vision_extract``."""
+        if render_pool is not None:
+            encoded = render_pool.render(pdf_path, page_indices, image_options)
+            urls = [to_data_url(data, image_options.mime_type) for data in encoded]
+        else:
+            with _FITZ_LOCK:
+                urls = [_render_page_data_url(doc[i], image_options) for i in page_indices]
+        for i, url in zip(page_indices, urls):
+            stats.record_payload(i + 1, len(url))
+        return urls
+
+    def _prepare(page_idx: int, rooms: list[str], render: bool = True) -> tuple[str, _LLMPageItems | str | None]:
+        """Resolve a content page from the cache or text layer, else render it for vision.
+
+        With ``render=False`` vision pages come back as ``("vision", None)`` so
+        the caller can render them in one batch."""
+        hit = cache.get("items", _items_key(rooms), page_keys[page_idx], _LLMPageItems) if cache else None
+        if hit is not None:
+            return "cache", hit
+        if use_text_layer:
+            with _FITZ_LOCK:
+                items = extract_text_items(doc[page_idx], rooms)
+            if items is not None:
+                return "text", _LLMPageItems(line_items=items)
+        if tiered:
+            hit = cache.get("fast_items", _fast_items_key(rooms), page_keys[page_idx], _LLMPageItems) if cache else None
+            if hit is not None:
+                return "cache", hit
+            return "fast", None  # rendered only if the page is escalated
+        return "vision", _render([page_idx])[0] if render else None
+
+    def _extract_fast(page_idx: int, rooms: list[str]) -> _LLMPageItems | None:
+        """Items from the text model, or None (recorded as an escalation) if they fail validation."""
+        with _FITZ_LOCK:
+            has_rows = numbered_rows(doc[page_idx]) > 0
+        if not has_rows:
+            # Nothing to validate against (e.g. a scanned page): straight to vision
+            stats.record_escalation(page_idx + 1, ["no numbered rows in the text layer"])
+            return None
+        print(f"    [{source}] extract page {page_idx+1}/{total_pages} (text model)", flush=True)
+        prompt = TEXT_EXTRACTION_PROMPT_TEMPLATE.format(rooms=", ".join(rooms))
+        result = chat(
+            prompt, page_texts[page_idx].strip(), _LLMPageItems, model=EXTRACTION_FAST_MODEL, stage="extract",
+        )
+        with _FITZ_LOCK:
+            problems = check_page_items(doc[page_idx], result.line_items, rooms)
+        if problems:
+            stats.record_escalation(page_idx + 1, problems)
+            return None
+        stats.incr("fast_pages")
+        return result
+
+    def _extract(page_idx: int, rooms: list[str], prepared: tuple[str, _LLMPageItems | str | None]) -> _LLMPageItems:
         label_page = page_offset + page_idx + 1
         if on_step:
             on_step(f"Extract page {label_page}/{label_total}")
+        kind, payload = prepared
+        if kind == "cache":
+            stats.incr("items_cache_hits")
+            return payload
+        if kind == "text":
+            stats.incr("text_pages")
+            return payload
+        stats.incr("items_cache_misses")
+        if kind == "fast":
+            result = _extract_fast(page_idx, rooms)
+            if result is not None:
+                if cache:
+                    cache.put("fast_items", _fast_items_key(rooms), page_keys[page_idx], result)
+                return result
+            payload = _render([page_idx])[0]
+        stats.incr("vision_pages")
         print(f"    [{source}] extract page {page_idx+1}/{total_pages}", flush=True)
         prompt = EXTRACTION_PROMPT_TEMPLATE.format(rooms=", ".join(rooms))
-        return page_idx, rooms, vision_extract(page_images[page_idx], _LLMPageItems, prompt)
-
-    extraction_results = list(_LLM_POOL.map(_extract, content_pages))
-
-    # Sequential bbox location (uses fitz Page objects)
-    rooms_dict: dict[str, list[ExtractedLineItem]] = {}
-    claimed_bboxes: dict[int, list[Bbox]] = {}  # page_idx -> claimed description bboxes
-    for page_idx, rooms, result in extraction_results:
-        page = doc[page_idx]
-        for item in result.line_items:
-            if item.quantity is None and item.unit_price is None and item.total is None:
-                continue
-            if source == "jdr":
-                claimed = claimed_bboxes.setdefault(page_idx, [])
-                bboxes = _locate_bboxes(page, item, claimed)
-                if bboxes.description:
-                    claimed.append(bboxes.description)
+        result = vision_extract(payload, _LLMPageItems, prompt, stage="extract")
+        if cache:
+            cache.put("items", _items_key(rooms), page_keys[page_idx], result)
+        return result
+
+    def _priced(result: _LLMPageItems) -> list[_LLMLineItem]:
+        return [
+            item for item in result.line_items
+            if not (item.quantity is None and item.unit_price is None and item.total is None)
+        ]
+
+    def _locate(
+        page_idx: int, rooms: list[str], items: list[_LLMLineItem],
+        all_bboxes: list[LineItemBboxes] | None = None,
+    ) -> list[tuple[str, ExtractedLineItem]]:
+        located: list[tuple[str, ExtractedLineItem]] = []
+        if source != "jdr":
+            all_bboxes = [LineItemBboxes() for _ in items]
+        elif all_bboxes is None:
+            if render_pool is not None:
+                all_bboxes = locate_document_bboxes(pdf_path, {page_idx: items}, render_pool)[page_idx]
             else:
-                bboxes = LineItemBboxes()
+                with _FITZ_LOCK:
+                    all_bboxes = _locate_page_bboxes(doc[page_idx], items)
+        for item, bboxes in zip(items, all_bboxes):
             extracted = ExtractedLineItem(
                 description=item.description,
                 quantity=item.quantity,
@@ -317,8 +861,53 @@ def parse_document(
                 page_number=page_idx + 1,
             )
             room_name = item.room_name if item.room_name in rooms else rooms[0]
+            located.append((room_name, extracted))
+        return located
+
+    if streaming:
+        # Each page flows through all stages independently; no cross-page barrier
+        def _process_page(page_idx: int) -> list[tuple[str, ExtractedLineItem]]:
+            rooms = _room_split(page_idx)
+            if not rooms:
+                return []
+            prepared = _prepare(page_idx, rooms)
+            return _locate(page_idx, rooms, _priced(_extract(page_idx, rooms, prepared)))
+
+        page_results = list(llm_map(_process_page, range(total_pages)))
+    else:
+        # Phased: room-split all pages, prepare all content pages, extract, then locate
+        page_rooms = list(llm_map(_room_split, range(total_pages)))
+        content_pages = [i for i, r in enumerate(page_rooms) if r]
+        prepared = {i: _prepare(i, page_rooms[i], render=False) for i in content_pages}
+        vision_pages = [i for i in content_pages if prepared[i][0] == "vision"]
+        for i, image in zip(vision_pages, _render(vision_pages)):
+            prepared[i] = ("vision", image)
+        extraction_results = list(llm_map(
+            lambda i: _extract(i, page_rooms[i], prepared[i]), content_pages,
+        ))
+        page_items = {i: _priced(result) for i, result in zip(content_pages, extraction_results)}
+        page_bboxes: dict[int, list[LineItemBboxes]] = {}
+        if source == "jdr" and render_pool is not None:
+            # One batch for the whole document, sharded across the worker processes
+            page_bboxes = locate_document_bboxes(pdf_path, page_items, render_pool)
+        page_results = [_locate(i, page_rooms[i], page_items[i], page_bboxes.get(i)) for i in content_pages]
+
+    print(
+        f"    [{source}] page cache: room split {stats.room_cache_hits} hits, {stats.room_cache_misses} misses, "
+        f"extraction {stats.items_cache_hits} hits, {stats.items_cache_misses} misses; "
+        f"room split: {stats.room_split_requests} requests, {stats.room_split_skipped} pages skipped; "
+        f"extraction: {stats.text_pages} text-layer, {stats.fast_pages} text-model, {stats.vision_pages} vision "
+        f"({sum(stats.payload_bytes.values()) / 1e6:.1f} MB of images)",
+        flush=True,
+    )
+
+    # Assemble rooms in page order
+    rooms_dict: dict[str, list[ExtractedLineItem]] = {}
+    for located in page_results:
+        for room_name, extracted in located:
             rooms_dict.setdefault(room_name, []).append(extracted)
 
-    doc.close()
+    with _FITZ_LOCK:
+        doc.close()
     rooms_list = [ExtractedRoom(room_name=name, line_items=items) for name, items in rooms_dict.items()]
     return ParsedDocument(source=source, rooms=rooms_list)
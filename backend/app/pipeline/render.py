@@ -0,0 +1,192 @@
+"""Page rendering for the vision model, optionally fanned out to worker processes.
+
+How a page is rasterized is controlled by ``ImageOptions`` (configured from
+``VISION_IMAGE_*`` environment variables): the page can be cropped to the
+detected line-item table, rendered at a DPI picked from its text size, in
+grayscale, and encoded as PNG, JPEG or WebP. The defaults reproduce the
+original full-page 200 DPI color PNG, so payload size can be traded against
+extraction accuracy by changing the environment and re-running
+``eval_matching.py``.
+
+fitz is not thread-safe, so in-process rendering is serialized. With
+``RENDER_WORKERS`` > 0 pages are rendered in a process pool instead: each
+worker opens its own ``fitz.Document`` handle and renders a shard of pages,
+returning the encoded image bytes to the parent. The same pool runs bbox
+location (``parse._locate_shard``) so that post-LLM CPU work also scales
+with the number of workers.
+
+Workers are started with the ``spawn`` method (forking a process that is
+already running LLM threads is unsafe), so scripts that enable the pool must
+keep their entry point under ``if __name__ == "__main__":``.
+"""
+
+import binascii
+import multiprocessing
+import os
+import statistics
+import threading
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import fitz
+
+from .text_extract import table_region
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "0"))
+RENDER_DPI = 200
+
+# Adaptive DPI: render so the median glyph is about this many pixels tall
+_TARGET_GLYPH_PX = 20
+_MIN_DPI, _MAX_DPI = 100, 220
+
+_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+# Base64 is produced in chunks (a multiple of 3 bytes) straight into the output buffer
+_B64_CHUNK = 3 * 16384
+
+
+@dataclass(frozen=True)
+class ImageOptions:
+    """How a page is rasterized and encoded for ``vision_extract``."""
+    dpi: int | None = RENDER_DPI  # None → pick from the page's text size
+    crop: bool = False
+    grayscale: bool = False
+    format: str = "png"  # png | jpeg | webp
+    quality: int = 85  # jpeg/webp only
+
+    @property
+    def mime_type(self) -> str:
+        return _MIME_TYPES[self.format]
+
+    @classmethod
+    def from_env(cls) -> "ImageOptions":
+        dpi = os.getenv("VISION_IMAGE_DPI", str(RENDER_DPI))
+        fmt = os.getenv("VISION_IMAGE_FORMAT", "png").lower().replace("jpg", "jpeg")
+        if fmt not in _MIME_TYPES:
+            raise ValueError(f"Unsupported VISION_IMAGE_FORMAT: {fmt}")
+        return cls(
+            dpi=None if dpi == "auto" else int(dpi),
+            crop=os.getenv("VISION_IMAGE_CROP", "0") == "1",
+            grayscale=os.getenv("VISION_IMAGE_GRAYSCALE", "0") == "1",
+            format=fmt,
+            quality=int(os.getenv("VISION_IMAGE_QUALITY", "85")),
+        )
+
+
+DEFAULT_IMAGE_OPTIONS = ImageOptions.from_env()
+
+
+def _adaptive_dpi(page: fitz.Page, clip: fitz.Rect | None) -> int:
+    heights = [
+        w[3] - w[1]
+        for w in page.get_text("words", clip=clip)
+        if w[3] > w[1]
+    ]
+    if not heights:
+        return RENDER_DPI
+    dpi = round(_TARGET_GLYPH_PX * 72 / statistics.median(heights))
+    return max(_MIN_DPI, min(_MAX_DPI, dpi))
+
+
+def render_page(page: fitz.Page, options: ImageOptions = DEFAULT_IMAGE_OPTIONS) -> bytes:
+    """Rasterize ``page`` and return the encoded image bytes."""
+    clip = table_region(page) if options.crop else None
+    dpi = options.dpi or _adaptive_dpi(page, clip)
+    pix = page.get_pixmap(
+        dpi=dpi,
+        clip=clip,
+        colorspace=fitz.csGRAY if options.grayscale else fitz.csRGB,
+    )
+    if options.format == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=options.quality)
+    if options.format == "webp":
+        return pix.pil_tobytes(format="WEBP", quality=options.quality)
+    return pix.tobytes("png")
+
+
+def to_data_url(data: bytes, mime_type: str) -> str:
+    """Base64-encode ``data`` as a data URL with a single full-size intermediate buffer."""
+    prefix = f"data:{mime_type};base64,".encode()
+    out = bytearray(len(prefix) + 4 * ((len(data) + 2) // 3))
+    out[:len(prefix)] = prefix
+    view = memoryview(data)
+    pos = len(prefix)
+    for i in range(0, len(data), _B64_CHUNK):
+        chunk = binascii.b2a_base64(view[i:i + _B64_CHUNK], newline=False)
+        out[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    return out.decode("ascii")
+
+
+# Per-worker-process document handles, keyed by (path, mtime)
+_worker_docs: dict[tuple[str, float], fitz.Document] = {}
+_MAX_WORKER_DOCS = 4
+
+
+def worker_doc(pdf_path: str) -> fitz.Document:
+    """The calling worker process's own (cached) handle for ``pdf_path``."""
+    key = (pdf_path, os.path.getmtime(pdf_path))
+    doc = _worker_docs.get(key)
+    if doc is None:
+        while len(_worker_docs) >= _MAX_WORKER_DOCS:
+            _worker_docs.pop(next(iter(_worker_docs))).close()
+        doc = _worker_docs[key] = fitz.open(pdf_path)
+    return doc
+
+
+def _render_shard(pdf_path: str, page_indices: list[int], options: ImageOptions) -> list[bytes]:
+    """Worker entry point: render ``page_indices`` from the worker's own handle."""
+    doc = worker_doc(pdf_path)
+    return [render_page(doc[i], options) for i in page_indices]
+
+
+class RenderPool:
+    """Bounded process pool for per-page fitz work: rendering and bbox location."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    def render(
+        self,
+        pdf_path: str,
+        page_indices: list[int],
+        options: ImageOptions = DEFAULT_IMAGE_OPTIONS,
+    ) -> list[bytes]:
+        """Render pages split into one contiguous shard per worker; results keep input order."""
+        return self.map_shards(_render_shard, pdf_path, page_indices, options)
+
+    def map_shards(self, fn: Callable[..., list], pdf_path: str, jobs: list, *args) -> list:
+        """Call ``fn(pdf_path, shard, *args)`` on one contiguous shard of ``jobs`` per worker.
+
+        ``fn`` must be a module-level function returning one result per job;
+        the flattened results keep the order of ``jobs``.
+        """
+        if not jobs:
+            return []
+        n = min(self.workers, len(jobs))
+        size = -(-len(jobs) // n)
+        shards = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+        futures = [self._executor.submit(fn, pdf_path, shard, *args) for shard in shards]
+        return [result for f in futures for result in f.result()]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+
+
+_default_pool: RenderPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderPool | None:
+    """Return the process-wide render pool, or None when ``RENDER_WORKERS`` is 0."""
+    global _default_pool
+    if RENDER_WORKERS <= 0:
+        return None
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = RenderPool(RENDER_WORKERS)
+    return _default_pool
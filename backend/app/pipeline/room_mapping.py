@@ -1,6 +1,23 @@
+import os
+import re
+
+import numpy as np
 from pydantic import BaseModel
 
 from ..llm import chat
+from .lexical import normalize, tfidf_matrix
+
+# A room pair scoring at least this (see ``_room_scores``) that is each
+# room's best option by ``_ROOM_MAP_MARGIN`` is mapped without the LLM
+# (0 sends every room to the LLM)
+ROOM_MAP_THRESHOLD = float(os.getenv("ROOM_MAP_THRESHOLD", "0.6"))
+_ROOM_MAP_MARGIN = 0.1
+# Share of the room score that comes from the names (the rest from shared line items)
+_NAME_WEIGHT = 0.6
+
+_PARENTHETICAL_RE = re.compile(r"\(.*?\)")
+_NAME_ALIASES = {"bath": "bathroom", "bdrm": "bedroom", "brm": "bedroom", "master": "primary", "mstr": "primary"}
+_NAME_STOPWORDS = frozenset({"room", "area", "the", "and", "of"})
 
 
 class RoomGroup(BaseModel):
@@ -23,7 +40,123 @@ Rules:
 - Use exact room names as provided — do not rename them."""
 
 
-def map_rooms(jdr_rooms: list[str], ins_rooms: list[str]) -> list[RoomGroup]:
+def _name_tokens(name: str) -> frozenset[str]:
+    """Room name words with qualifiers in parentheses, filler words and common abbreviations normalized away."""
+    words = normalize(_PARENTHETICAL_RE.sub(" ", name)).split() or normalize(name).split()
+    words = [_NAME_ALIASES.get(w, w) for w in words]
+    return frozenset(w for w in words if w not in _NAME_STOPWORDS) or frozenset(words)
+
+
+def _name_similarity(a: frozenset[str], b: frozenset[str]) -> float:
+    """Dice overlap of two name token sets; 0 when both carry different numbers ("Bedroom 1" / "Bedroom 2")."""
+    if not a or not b:
+        return 0.0
+    a_numbers = {t for t in a if t[0].isdigit()}
+    b_numbers = {t for t in b if t[0].isdigit()}
+    if a_numbers and b_numbers and a_numbers != b_numbers:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def _room_scores(
+    jdr_rooms: list[str],
+    ins_rooms: list[str],
+    jdr_descriptions: dict[str, list[str]],
+    ins_descriptions: dict[str, list[str]],
+) -> np.ndarray:
+    """(JDR, insurance) room pair scores in [0, 1].
+
+    For rooms that both have line items, a weighted mean of name similarity
+    and content similarity: the cosine of the rooms' TF-IDF-weighted sets of
+    normalized item descriptions. Lines only a few rooms have (vanity, tub,
+    toilet) count and lines every room has (debris haul-off, floor
+    protection) barely do. Otherwise the name similarity alone. Without a
+    name in common a pair scores at most ``1 - _NAME_WEIGHT``.
+    """
+    jdr_tokens = [_name_tokens(room) for room in jdr_rooms]
+    ins_tokens = [_name_tokens(room) for room in ins_rooms]
+    names = np.array([[_name_similarity(a, b) for b in ins_tokens] for a in jdr_tokens], dtype=np.float32)
+    docs = [{normalize(d) for d in jdr_descriptions.get(room, [])} for room in jdr_rooms]
+    docs += [{normalize(d) for d in ins_descriptions.get(room, [])} for room in ins_rooms]
+    has_items = np.array([bool(doc) for doc in docs])
+    content = tfidf_matrix(docs)
+    n = len(jdr_rooms)
+    blended = _NAME_WEIGHT * names + (1 - _NAME_WEIGHT) * (content[:n] @ content[n:].T)
+    return np.where(has_items[:n, None] & has_items[None, n:], blended, names)
+
+
+def _confident_pairs(scores: np.ndarray, threshold: float) -> list[tuple[int, int]]:
+    """Room index pairs that are each other's clear best option.
+
+    Repeated on the rooms left over, since taking "Entry" ↔ "Entry" can
+    leave "Entry Hallway" with a single obvious partner.
+    """
+    pairs: list[tuple[int, int]] = []
+    rows = list(range(scores.shape[0]))
+    cols = list(range(scores.shape[1]))
+    while rows and cols:
+        sub = scores[np.ix_(rows, cols)]
+        best_col = sub.argmax(axis=1)
+        best_row = sub.argmax(axis=0)
+        row_second = np.sort(sub, axis=1)[:, -2] if len(cols) > 1 else np.zeros(len(rows))
+        col_second = np.sort(sub, axis=0)[-2, :] if len(rows) > 1 else np.zeros(len(cols))
+        found = [
+            (r, int(c)) for r, c in enumerate(best_col)
+            if sub[r, c] >= threshold
+            and best_row[c] == r
+            and sub[r, c] - row_second[r] >= _ROOM_MAP_MARGIN
+            and sub[r, c] - col_second[c] >= _ROOM_MAP_MARGIN
+        ]
+        if not found:
+            break
+        pairs += [(rows[r], cols[c]) for r, c in found]
+        taken_rows = {r for r, _ in found}
+        taken_cols = {c for _, c in found}
+        rows = [i for r, i in enumerate(rows) if r not in taken_rows]
+        cols = [j for c, j in enumerate(cols) if c not in taken_cols]
+    return pairs
+
+
+def _llm_map_rooms(jdr_rooms: list[str], ins_rooms: list[str]) -> list[tuple[str, str]]:
+    """(JDR, insurance) room pairs proposed by the LLM, limited to the given names, each used once."""
     user_msg = f"JDR rooms: {jdr_rooms}\nInsurance rooms: {ins_rooms}"
-    result = chat(ROOM_MAPPING_PROMPT, user_msg, _RoomMapping)
-    return result.groups
+    result = chat(ROOM_MAPPING_PROMPT, user_msg, _RoomMapping, stage="room-map")
+    free_jdr, free_ins = set(jdr_rooms), set(ins_rooms)
+    pairs = []
+    for group in result.groups:
+        if group.jdr_room in free_jdr and group.ins_room in free_ins:
+            pairs.append((group.jdr_room, group.ins_room))
+            free_jdr.discard(group.jdr_room)
+            free_ins.discard(group.ins_room)
+    return pairs
+
+
+def map_rooms(
+    jdr_rooms: list[str],
+    ins_rooms: list[str],
+    jdr_descriptions: dict[str, list[str]] | None = None,
+    ins_descriptions: dict[str, list[str]] | None = None,
+) -> list[RoomGroup]:
+    """Pair JDR rooms with insurance rooms; unpaired rooms get a group of their own.
+
+    Rooms whose pairing is clear from their names and line-item descriptions
+    (keyed by room name) are mapped locally. Only the rest go to the LLM,
+    so a job whose rooms all map confidently makes no call here.
+    """
+    pairs: list[tuple[str, str]] = []
+    if ROOM_MAP_THRESHOLD > 0 and jdr_rooms and ins_rooms:
+        scores = _room_scores(jdr_rooms, ins_rooms, jdr_descriptions or {}, ins_descriptions or {})
+        pairs = [(jdr_rooms[i], ins_rooms[j]) for i, j in _confident_pairs(scores, ROOM_MAP_THRESHOLD)]
+
+    paired_jdr = {a for a, _ in pairs}
+    paired_ins = {b for _, b in pairs}
+    rest_jdr = [room for room in jdr_rooms if room not in paired_jdr]
+    rest_ins = [room for room in ins_rooms if room not in paired_ins]
+    if rest_jdr and rest_ins:
+        pairs += _llm_map_rooms(rest_jdr, rest_ins)
+
+    partner = dict(pairs)
+    groups = [RoomGroup(jdr_room=room, ins_room=partner.get(room)) for room in jdr_rooms]
+    paired_ins = set(partner.values())
+    groups += [RoomGroup(ins_room=room) for room in ins_rooms if room not in paired_ins]
+    return groups
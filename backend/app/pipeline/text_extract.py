@@ -0,0 +1,332 @@
+"""Deterministic line-item extraction from a page's native text layer.
+
+Xactimate PDFs lay line items out on a fixed column grid under a header row
+(DESCRIPTION / QTY / REPLACE / TOTAL for JDR proposals, QUANTITY / UNIT PRICE /
+RCV for insurance estimates). When the PDF has a real text layer we can read
+that grid directly with ``page.get_text("words")`` instead of rendering the
+page and calling the vision model.
+
+Two row layouts are handled:
+
+- inline — the numbered description and its values share a row, and a
+  wrapped description continues on the next (tightly spaced) row;
+- stacked — the numbered description sits on its own row and the quantity,
+  unit price, etc. are on the row below it.
+
+The extractor is deliberately strict: if the header row is missing, line
+numbers are not consecutive, a value lands in an unexpected column, or any
+item fails the ``quantity × unit price + tax + O&P ≈ total`` check, it
+returns None and the caller falls back to the vision model.
+"""
+
+import re
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+
+import fitz
+
+Word = tuple  # (x0, y0, x1, y1, "text", block_no, line_no, word_no)
+
+_LINE_NO_RE = re.compile(r"^(\d{1,4})\.$")
+NUMBER_RE = re.compile(r"^\(?-?[\d,]*\d\.\d+\)?$")
+_UNIT_RE = re.compile(r"^[A-Z]{1,4}$")
+
+# Header labels → column role. Roles other than the ones used in
+# ``_check_arithmetic`` only exist so their values are not mis-assigned
+# to a neighbouring column.
+_HEADER_LABELS: dict[tuple[str, ...], str] = {
+    ("UNIT", "PRICE"): "unit_price",
+    ("QUANTITY",): "quantity",
+    ("QTY",): "quantity",
+    ("REPLACE",): "unit_price",
+    ("REMOVE",): "remove",
+    ("TOTAL",): "total",
+    ("RCV",): "total",
+    ("TAX",): "tax",
+    ("O&P",): "op",
+    ("GCO&P",): "op",
+    ("DEPREC.",): "deprec",
+    ("ACV",): "acv",
+    ("AGE/LIFE",): "age",
+    ("DESCRIPTION",): "description",
+}
+_REQUIRED_ROLES = {"quantity", "unit_price", "total"}
+
+# Max vertical gap (in line heights) between a description row and its wrapped continuation
+_CONTINUATION_GAP = 1.2
+_STACKED_GAP = 2.5
+
+
+@dataclass
+class Column:
+    role: str
+    x0: float
+    x1: float
+
+
+@dataclass
+class _PendingItem:
+    number: int
+    room_name: str
+    desc_words: list[Word]
+    last_row: list[Word]
+    values: dict | None = None
+    inline: bool = False
+
+
+def group_rows(words: list[Word]) -> list[list[Word]]:
+    """Group words into visual rows (top to bottom, left to right)."""
+    rows: list[list[Word]] = []
+    for w in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        mid = (w[1] + w[3]) / 2
+        if rows:
+            last = rows[-1][0]
+            last_mid = (last[1] + last[3]) / 2
+            if abs(mid - last_mid) < 0.5 * min(w[3] - w[1], last[3] - last[1]):
+                rows[-1].append(w)
+                continue
+        rows.append([w])
+    return [sorted(r, key=lambda w: w[0]) for r in rows]
+
+
+def row_text(row: list[Word]) -> str:
+    return " ".join(w[4] for w in row)
+
+
+def _row_height(row: list[Word]) -> float:
+    return max(w[3] - w[1] for w in row)
+
+
+def header_columns(row: list[Word]) -> list[Column] | None:
+    """Return the column layout if ``row`` is a line-item table header."""
+    columns: list[Column] = []
+    i = 0
+    while i < len(row):
+        for label, role in _HEADER_LABELS.items():
+            n = len(label)
+            if tuple(w[4].upper() for w in row[i:i + n]) == label:
+                columns.append(Column(role, row[i][0], row[i + n - 1][2]))
+                i += n
+                break
+        else:
+            i += 1
+    if not _REQUIRED_ROLES <= {c.role for c in columns}:
+        return None
+    return columns
+
+
+def column_for(word: Word, columns: list[Column]) -> str:
+    """Assign a value token to the header column it sits under."""
+    def _distance(c: Column) -> tuple[float, float]:
+        gap = max(c.x0 - word[2], word[0] - c.x1, 0.0)
+        return gap, abs(word[2] - c.x1)
+    return min(columns, key=_distance).role
+
+
+def to_decimal(text: str) -> Decimal | None:
+    neg = text.startswith("(") and text.endswith(")")
+    try:
+        value = Decimal(text.strip("()").replace(",", ""))
+    except InvalidOperation:
+        return None
+    return -value if neg else value
+
+
+def line_number(row: list[Word]) -> tuple[int, int] | None:
+    """Return (line number, index of the number token) for a numbered item row."""
+    for idx in range(min(2, len(row))):
+        m = _LINE_NO_RE.match(row[idx][4])
+        if m:
+            # Allow a single leading marker such as "*" before the number
+            if idx == 1 and row[0][4].isalnum():
+                return None
+            return int(m.group(1)), idx
+    return None
+
+
+def _find_quantity(row: list[Word], columns: list[Column], start: int = 0) -> int | None:
+    """Index of the quantity token (a number followed by a unit under the QTY column)."""
+    for k in range(start, len(row) - 1):
+        if (
+            NUMBER_RE.match(row[k][4])
+            and _UNIT_RE.match(row[k + 1][4])
+            and column_for(row[k], columns) == "quantity"
+        ):
+            return k
+    return None
+
+
+def _parse_values(tokens: list[Word], columns: list[Column]) -> dict | None:
+    """Parse ``[qty, unit, value, value, ...]`` into a role → value mapping."""
+    values: dict = {"quantity": to_decimal(tokens[0][4]), "unit": tokens[1][4]}
+    rest = tokens[2:]
+    if "OPEN ITEM" in row_text(rest).upper():
+        values["open"] = True
+        return values
+    for w in rest:
+        if not NUMBER_RE.match(w[4]):
+            continue
+        role = column_for(w, columns)
+        if role in values:
+            return None
+        values[role] = to_decimal(w[4])
+    return values
+
+
+def _check_arithmetic(values: dict) -> bool:
+    if values.get("open"):
+        return True
+    qty = values.get("quantity")
+    price = values.get("unit_price")
+    total = values.get("total")
+    if qty is None or price is None or total is None:
+        return False
+    expected = qty * (price + values.get("remove", 0)) + values.get("tax", 0) + values.get("op", 0)
+    return abs(expected - total) <= Decimal("0.02") + abs(total) * Decimal("0.002")
+
+
+def _room_header(row: list[Word], rooms: list[str]) -> str | None:
+    text = re.sub(r"^CONTINUED\s*-\s*", "", row_text(row), flags=re.IGNORECASE).strip().lower()
+    for room in rooms:
+        if text == room.strip().lower():
+            return room
+    return None
+
+
+def extract_text_items(page: fitz.Page, rooms: list[str]) -> list[dict] | None:
+    """Extract line items from ``page``'s text layer.
+
+    Returns dicts shaped like the vision model's line items (description,
+    quantity, unit, unit_price, total, room_name), or None if the page does
+    not validate and should go to the vision model instead.
+    """
+    if not rooms:
+        return None
+    rows = group_rows(page.get_text("words"))
+
+    columns: list[Column] | None = None
+    current_room = rooms[0]
+    seen_rooms: set[str] = set()
+    items: list[_PendingItem] = []
+    pending: _PendingItem | None = None
+
+    for row in rows:
+        header = header_columns(row)
+        if header is not None:
+            columns = header
+            pending = None
+            continue
+
+        room = _room_header(row, rooms)
+        if room is not None:
+            current_room = room
+            seen_rooms.add(room)
+            pending = None
+            continue
+
+        first = row[0][4].rstrip(":").lower()
+        if first in ("total", "totals"):
+            pending = None
+            continue
+
+        numbered = line_number(row)
+        if numbered is not None:
+            if columns is None:
+                return None
+            number, lead = numbered
+            k = _find_quantity(row, columns, lead + 1)
+            pending = _PendingItem(
+                number=number,
+                room_name=current_room,
+                desc_words=list(row[lead + 1:k]),
+                last_row=row,
+            )
+            if k is not None:
+                pending.values = _parse_values(row[k:], columns)
+                if pending.values is None:
+                    return None
+                pending.inline = True
+            items.append(pending)
+            continue
+
+        if pending is None or columns is None:
+            continue
+
+        gap = row[0][1] - pending.last_row[0][3]
+        height = _row_height(pending.last_row)
+        if pending.values is None:
+            # Stacked layout: wrapped description rows, then the values row
+            if gap > _STACKED_GAP * height:
+                pending = None
+                continue
+            k = _find_quantity(row, columns)
+            if k is None:
+                pending.desc_words.extend(row)
+            else:
+                pending.desc_words.extend(row[:k])
+                pending.values = _parse_values(row[k:], columns)
+                if pending.values is None:
+                    return None
+            pending.last_row = row
+        elif (
+            pending.inline
+            and row[0][1] - pending.last_row[0][1] <= _CONTINUATION_GAP * height
+            and not any(NUMBER_RE.match(w[4]) for w in row)
+        ):
+            pending.desc_words.extend(row)
+            pending.last_row = row
+        else:
+            pending = None
+
+    if not items:
+        return None
+    if any(room not in seen_rooms for room in rooms[1:]):
+        return None
+    for prev, cur in zip(items, items[1:]):
+        if cur.number != prev.number + 1:
+            return None
+
+    results: list[dict] = []
+    for item in items:
+        if item.values is None or not item.desc_words or not _check_arithmetic(item.values):
+            return None
+        values = item.values
+        results.append({
+            "description": " ".join(w[4] for w in item.desc_words),
+            "quantity": values.get("quantity"),
+            "unit": values.get("unit"),
+            "unit_price": values.get("unit_price"),
+            "total": values.get("total"),
+            "room_name": item.room_name,
+        })
+    return results
+
+
+def table_region(page: fitz.Page, title_margin: float = 36.0) -> fitz.Rect | None:
+    """Bounding rect of the line-item table(s) on ``page``, or None if no header row is found.
+
+    Spans the first header row through the last numbered item (plus its
+    wrapped/stacked rows) or subtotal row. ``title_margin`` points are kept
+    above the header so a room title sitting directly over the table stays
+    in view.
+    """
+    rows = group_rows(page.get_text("words"))
+    headers = [i for i, row in enumerate(rows) if header_columns(row) is not None]
+    if not headers:
+        return None
+    last = headers[0]
+    for i in range(headers[0], len(rows)):
+        if line_number(rows[i]) is not None or rows[i][0][4].rstrip(":").lower() in ("total", "totals"):
+            last = i
+    # Keep the rows that hang off the last anchor (wrapped description, stacked values)
+    while last + 1 < len(rows) and rows[last + 1][0][1] - rows[last][0][3] < 2 * _row_height(rows[last]):
+        last += 1
+
+    words = [w for row in rows[headers[0]:last + 1] for w in row]
+    rect = fitz.Rect(
+        min(w[0] for w in words) - 4,
+        min(w[1] for w in words) - title_margin,
+        max(w[2] for w in words) + 4,
+        max(w[3] for w in words) + 4,
+    )
+    return rect & page.rect
@@ -0,0 +1,95 @@
+"""Local checks for line items extracted by a model from a page.
+
+Used by tiered extraction (see ``parse_document``): a page read by the
+cheap text-only model is kept only if its items pass every check that the
+page's text layer allows, and is otherwise escalated to the vision model.
+
+- count — one item per numbered row on the page;
+- arithmetic — each priced item's total is between ``quantity × unit
+  price`` and that plus ``_MAX_MARKUP`` (Xactimate totals include tax and
+  overhead & profit, typically 20-30% here);
+- room subtotal — for a room that starts on the page and whose "Totals:"
+  row is also on it, the item totals add up to the row's total column.
+"""
+
+import re
+from decimal import Decimal
+
+import fitz
+
+from .text_extract import (
+    NUMBER_RE,
+    column_for,
+    group_rows,
+    header_columns,
+    line_number,
+    row_text,
+    to_decimal,
+)
+
+_MAX_MARKUP = 0.4
+_ABS_TOLERANCE = 0.02
+_SUBTOTAL_TOLERANCE = 0.01  # relative
+_TOTALS_ROW_RE = re.compile(r"^Totals?:\s*(.+?)\s*$", re.IGNORECASE)
+
+
+def numbered_rows(page: fitz.Page) -> int:
+    """Number of distinct numbered line-item rows on ``page``."""
+    numbers = set()
+    for row in group_rows(page.get_text("words")):
+        line = line_number(row)
+        if line is not None:
+            numbers.add(line[0])
+    return len(numbers)
+
+
+def room_subtotals(page: fitz.Page, rooms: list[str]) -> dict[str, Decimal]:
+    """Totals-row value of each room that both starts and ends on ``page``."""
+    rows = group_rows(page.get_text("words"))
+    columns = next((c for c in map(header_columns, rows) if c is not None), None)
+    if columns is None:
+        return {}
+    by_name = {room.strip().lower(): room for room in rooms}
+    started: set[str] = set()
+    subtotals: dict[str, Decimal] = {}
+    for row in rows:
+        text = row_text(row).strip()
+        if text.lower() in by_name:
+            started.add(by_name[text.lower()])
+            continue
+        m = _TOTALS_ROW_RE.match(text)
+        if not m:
+            continue
+        # The room name is followed by the numeric columns; match it by prefix
+        label = m.group(1).lower()
+        room = next((by_name[name] for name in by_name if label.startswith(name)), None)
+        if room is None or room not in started:
+            continue
+        values = [w[4] for w in row if NUMBER_RE.match(w[4]) and column_for(w, columns) == "total"]
+        if len(values) == 1:
+            subtotals[room] = to_decimal(values[0])
+    return subtotals
+
+
+def check_page_items(page: fitz.Page, items: list, rooms: list[str]) -> list[str]:
+    """Reasons ``items`` (model line items) look wrong for ``page``; empty if they pass."""
+    problems: list[str] = []
+    expected = numbered_rows(page)
+    if expected == 0:
+        return ["no numbered rows in the text layer"]
+    if len(items) != expected:
+        problems.append(f"{len(items)} items for {expected} numbered rows")
+
+    for item in items:
+        if item.quantity is None or item.unit_price is None or item.total is None:
+            continue
+        base = item.quantity * item.unit_price
+        low, high = sorted((base, base * (1 + _MAX_MARKUP)))
+        if not low - _ABS_TOLERANCE <= item.total <= high + _ABS_TOLERANCE:
+            problems.append(f"total {item.total} outside {item.quantity} × {item.unit_price} for {item.description!r}")
+
+    for room, subtotal in room_subtotals(page, rooms).items():
+        summed = sum(item.total or 0 for item in items if item.room_name == room)
+        if abs(summed - float(subtotal)) > _ABS_TOLERANCE + abs(float(subtotal)) * _SUBTOTAL_TOLERANCE:
+            problems.append(f"{room} items sum to {summed:.2f}, page subtotal is {subtotal}")
+    return problems
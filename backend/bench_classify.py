@@ -0,0 +1,126 @@
+"""
+Benchmark the batch pair classifier against the one-pair path.
+
+  uv run python bench_classify.py                    # 1k, 10k and 100k pairs
+  uv run python bench_classify.py --pairs 50000 --repeat 5
+
+Generates synthetic matched pairs (equal values, values within and just
+outside the 2% tolerance, exact-boundary values, unit mismatches, missing
+and zero fields), checks that ``classify_pairs`` gives the same colors and
+diff notes as ``_classify_pair`` for every pair and that ``PairColumns``
+agrees with it under every swept tolerance, and reports the best time of:
+
+- one-pair — ``_classify_pair`` in a loop (what the pipeline uses per room);
+- batch — ``classify_pairs`` from line items, including column building
+  and ``DiffNote`` creation for orange pairs;
+- sweep — colors under each of ``--tolerances`` settings, as
+  ``eval_matching.py tolerances`` computes them: the one-pair loop once per
+  setting, against ``PairColumns.from_pairs`` once plus one
+  ``diff_codes`` pass per setting.
+
+Reading fields off the models and building the orange pairs' notes cost
+about as much as the comparisons, so a single batch pass is no faster than
+the loop; the win is in classifying the same pairs more than once.
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from app.pipeline.matching import PairColumns, _classify_pair, classify_pairs
+from app.schemas import ExtractedLineItem
+
+UNITS = ["SF", "LF", "EA", "SY", "HR", "SQ"]
+
+
+def log(msg: str):
+    print(msg, flush=True)
+
+
+def _vary(value: Decimal, rng: random.Random) -> Decimal | None:
+    r = rng.random()
+    if r < 0.5:
+        return value
+    if r < 0.65:
+        return (value * Decimal(str(1 + rng.uniform(-0.019, 0.019)))).quantize(Decimal("0.01"))
+    if r < 0.75:
+        return (value * (Decimal("1.02") if rng.random() < 0.5 else Decimal("0.98"))).quantize(Decimal("0.01"))
+    if r < 0.9:
+        return (value * Decimal(str(rng.uniform(0.5, 1.5)))).quantize(Decimal("0.01"))
+    if r < 0.95:
+        return None
+    return Decimal("0")
+
+
+def make_pairs(n: int, seed: int = 0) -> list[tuple[ExtractedLineItem, ExtractedLineItem]]:
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        quantity = Decimal(rng.randint(1, 50000)) / 100
+        unit_price = Decimal(rng.randint(1, 200000)) / 100
+        unit = rng.choice(UNITS)
+        jdr = ExtractedLineItem(
+            description="Item", page_number=1, quantity=quantity, unit=unit, unit_price=unit_price,
+            total=(quantity * unit_price * Decimal("1.25")).quantize(Decimal("0.01")),
+        )
+        ins_quantity, ins_price = _vary(quantity, rng), _vary(unit_price, rng)
+        ins = ExtractedLineItem(
+            description="Item",
+            page_number=1,
+            quantity=ins_quantity,
+            unit=unit if rng.random() < 0.9 else rng.choice(UNITS).lower() + " ",
+            unit_price=ins_price,
+            total=_vary(jdr.total, rng),
+        )
+        pairs.append((jdr, ins))
+    return pairs
+
+
+def best_of(repeat: int, fn) -> tuple[float, object]:
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerances", type=float, nargs="+", default=[0.01, 0.02, 0.03, 0.05, 0.1])
+    args = parser.parse_args()
+    settings = [dict.fromkeys(("quantity", "unit_price", "total"), pct) for pct in args.tolerances]
+
+    log(f"{'pairs':>8}  {'one-pair':>10}  {'batch':>10}  {'batch x':>8}  "
+        f"{'sweep 1x1':>10}  {'sweep cols':>10}  {'sweep x':>8}  orange")
+    for n in args.pairs:
+        pairs = make_pairs(n, args.seed)
+        scalar_time, expected = best_of(args.repeat, lambda: [_classify_pair(j, i) for j, i in pairs])
+        batch_time, got = best_of(args.repeat, lambda: classify_pairs(pairs))
+        if got != expected:
+            bad = next(k for k, (a, b) in enumerate(zip(got, expected)) if a != b)
+            raise SystemExit(f"Mismatch at pair {bad}: batch={got[bad]} one-pair={expected[bad]}")
+
+        def sweep_scalar():
+            return [[bool(_classify_pair(j, i, tol)[1]) for j, i in pairs] for tol in settings]
+
+        def sweep_columns():
+            columns = PairColumns.from_pairs(pairs)
+            return [(columns.diff_codes(tol) != 0).tolist() for tol in settings]
+
+        sweep_scalar_time, sweep_expected = best_of(args.repeat, sweep_scalar)
+        sweep_columns_time, sweep_got = best_of(args.repeat, sweep_columns)
+        if sweep_got != sweep_expected:
+            raise SystemExit("Mismatch between the one-pair and columnar tolerance sweeps")
+        orange = sum(color.value == "orange" for color, _ in got)
+        log(f"{n:>8}  {scalar_time * 1000:>8.1f}ms  {batch_time * 1000:>8.1f}ms  {scalar_time / batch_time:>7.2f}x  "
+            f"{sweep_scalar_time * 1000:>8.1f}ms  {sweep_columns_time * 1000:>8.1f}ms  "
+            f"{sweep_scalar_time / sweep_columns_time:>7.1f}x  {orange / n:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Local stand-in for the LLM gateway (OpenAI-compatible /chat/completions).
+
+Records real gateway responses once, then replays them offline with
+injected latency, jitter and errors so the backend can be load-tested
+without the live gateway:
+
+  uv run python fake_gateway.py record                 # proxy to the gateway, save responses
+  uv run python fake_gateway.py replay --latency 1.5 --vision-latency 8 --jitter 0.4 --error-rate 0.02
+
+Point the backend at it with GATEWAY_BASE_URL=http://127.0.0.1:8001 (and
+empty PAGE_CACHE_DIR and no LLM_CACHE_PATH so every job really reaches it).
+
+Responses are keyed by model, messages and response_format, so a recording
+of the sample proposals replays for any job that submits the same PDFs.
+Unrecorded requests get a placeholder that satisfies the requested JSON
+schema (``--on-miss synth``) or a 404 (``--on-miss error``).
+
+Can also be started in-process (``FakeGateway(...).start()``), e.g. from
+a script that drives the pipeline functions directly.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+RECORDINGS_DIR = Path(".gateway_recordings")
+UPSTREAM = "https://api.llmgateway.ciridae.app"
+
+
+def log(msg: str):
+    print(msg, flush=True)
+
+
+@dataclass
+class Faults:
+    latency: float = 1.0  # median seconds per text request
+    vision_latency: float = 6.0  # median seconds per request with an image
+    jitter: float = 0.3  # sigma of the log-normal latency multiplier (0 = fixed)
+    error_rate: float = 0.0  # fraction of requests answered with a 5xx
+    max_concurrency: int = 0  # requests above this many in flight get a 429 (0 = unlimited)
+    retry_after: float = 1.0  # Retry-After sent with 429s
+    recorded_latency: bool = False  # replay each response with the upstream latency it was recorded with
+
+
+def request_key(body: dict) -> str:
+    """Hash the parts of a chat completion request that determine its response."""
+    relevant = {k: body.get(k) for k in ("model", "messages", "response_format")}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def has_image(body: dict) -> bool:
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+
+# ── Placeholder responses ────────────────────────────────────────────
+
+def synthesize(schema: dict, defs: dict | None = None):
+    """Smallest non-empty instance of a JSON schema (one element per array)."""
+    defs = defs if defs is not None else schema.get("$defs", {})
+    if "$ref" in schema:
+        return synthesize(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            options = [s for s in schema[key] if s.get("type") != "null"] or schema[key]
+            return synthesize(options[0], defs)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        return {name: synthesize(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [synthesize(schema.get("items", {}), defs)]
+    if kind == "string":
+        return "placeholder"
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return False
+    return None
+
+
+def completion(model: str, content: str) -> dict:
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def upstream_error(message: str) -> dict:
+    # Truncated so a proxy's HTML error page doesn't flood the client's logs
+    return {"error": {"message": message[:2000], "type": "upstream_error"}}
+
+
+# ── Server ───────────────────────────────────────────────────────────
+
+class FakeGateway:
+    """OpenAI-compatible record/replay server with injected latency and faults."""
+
+    def __init__(
+        self,
+        mode: str = "replay",
+        recordings: Path = RECORDINGS_DIR,
+        upstream: str = UPSTREAM,
+        faults: Faults | None = None,
+        on_miss: str = "synth",
+    ):
+        self.mode = mode
+        self.recordings = Path(recordings)
+        self.upstream = upstream.rstrip("/")
+        self.faults = faults or Faults()
+        self.on_miss = on_miss
+        self.stats = {"requests": 0, "replayed": 0, "recorded": 0, "synthesized": 0,
+                      "missed": 0, "errors": 0, "throttled": 0, "in_flight": 0, "max_in_flight": 0}
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self.recordings.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "FakeGateway":
+        """Serve in a daemon thread (port 0 picks a free port, see ``url``)."""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self, host: str, port: int) -> None:
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def _count(self, name: str, delta: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += delta
+
+    def _handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                try:
+                    raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                except ConnectionError:
+                    self.close_connection = True  # client went away mid-request (e.g. a cancelled hedge)
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    return self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                try:
+                    body = json.loads(raw)
+                except json.JSONDecodeError as e:
+                    # Includes bodies truncated by a client that disconnected while sending
+                    return self._send(400, {"error": {"message": f"invalid JSON body: {e}", "type": "invalid_request_error"}})
+                status, payload, headers = gateway.handle(body, raw, self.headers)
+                self._send(status, payload, headers)
+
+            def _send(self, status: int, payload: dict, headers: dict | None = None):
+                out = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(out)))
+                    for name, value in (headers or {}).items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(out)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on this request, e.g. the losing copy of a hedged call
+                    self.close_connection = True
+
+        return Handler
+
+    def handle(self, body: dict, raw: bytes, headers) -> tuple[int, dict, dict]:
+        faults = self.faults
+        with self._lock:
+            self.stats["requests"] += 1
+            throttled = 0 < faults.max_concurrency <= self.stats["in_flight"]
+            if throttled:
+                self.stats["throttled"] += 1
+            else:
+                self.stats["in_flight"] += 1
+                self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.stats["in_flight"])
+        if throttled:
+            return 429, {"error": {"message": "rate limited"}}, {"Retry-After": f"{faults.retry_after:g}"}
+        try:
+            if self.mode == "record":
+                return self._record(body, raw, headers)
+            return self._replay(body)
+        finally:
+            self._count("in_flight", -1)
+
+    def _delay(self, body: dict, recorded: float | None) -> float:
+        faults = self.faults
+        if faults.recorded_latency and recorded is not None:
+            base = recorded
+        else:
+            base = faults.vision_latency if has_image(body) else faults.latency
+        return base * (math.exp(random.gauss(0.0, faults.jitter)) if faults.jitter > 0 else 1.0)
+
+    def _replay(self, body: dict) -> tuple[int, dict, dict]:
+        path = self.recordings / f"{request_key(body)}.json"
+        recorded = None
+        if path.exists():
+            entry = json.loads(path.read_text())
+            response, recorded = entry["response"], entry.get("elapsed")
+            self._count("replayed")
+        elif self.on_miss == "synth":
+            fmt = body.get("response_format") or {}
+            schema = (fmt.get("json_schema") or {}).get("schema", {})
+            response = completion(body.get("model", ""), json.dumps(synthesize(schema)))
+            self._count("synthesized")
+        else:
+            self._count("missed")
+            return 404, {"error": {"message": "no recording for this request"}}, {}
+
+        time.sleep(self._delay(body, recorded))
+        if random.random() < self.faults.error_rate:
+            self._count("errors")
+            return random.choice((500, 502, 503)), {"error": {"message": "injected failure"}}, {}
+        return 200, response, {}
+
+    def _record(self, body: dict, raw: bytes, headers) -> tuple[int, dict, dict]:
+        request = urllib.request.Request(
+            f"{self.upstream}/chat/completions",
+            data=raw,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": headers.get("Authorization", ""),
+            },
+        )
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=600) as resp:
+                status, text = resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            retry_after = e.headers.get("Retry-After")
+            text = e.read()
+            try:
+                payload = json.loads(text or b"{}")
+            except ValueError:
+                return 502, upstream_error(f"upstream {e.code}: {text.decode(errors='replace')}"), {}
+            return e.code, payload, {"Retry-After": retry_after} if retry_after else {}
+        except (urllib.error.URLError, OSError) as e:
+            # Unreachable upstream, refused connection or timeout
+            return 502, upstream_error(f"upstream unavailable: {getattr(e, 'reason', e)}"), {}
+        try:
+            payload = json.loads(text)
+        except ValueError:
+            return 502, upstream_error(f"upstream {status}: {text.decode(errors='replace')}"), {}
+        elapsed = time.monotonic() - start
+        path = self.recordings / f"{request_key(body)}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps({"model": body.get("model"), "elapsed": round(elapsed, 3), "response": payload}))
+        tmp.replace(path)
+        self._count("recorded")
+        return status, payload, {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--recordings", type=Path, default=RECORDINGS_DIR)
+    parser.add_argument("--upstream", default=os.getenv("GATEWAY_UPSTREAM", UPSTREAM))
+    parser.add_argument("--on-miss", choices=("synth", "error"), default="synth")
+    parser.add_argument("--latency", type=float, default=Faults.latency)
+    parser.add_argument("--vision-latency", type=float, default=Faults.vision_latency)
+    parser.add_argument("--jitter", type=float, default=Faults.jitter)
+    parser.add_argument("--error-rate", type=float, default=Faults.error_rate)
+    parser.add_argument("--max-concurrency", type=int, default=Faults.max_concurrency)
+    parser.add_argument("--retry-after", type=float, default=Faults.retry_after)
+    parser.add_argument("--recorded-latency", action="store_true")
+    args = parser.parse_args()
+
+    faults = Faults(
+        latency=args.latency,
+        vision_latency=args.vision_latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        max_concurrency=args.max_concurrency,
+        retry_after=args.retry_after,
+        recorded_latency=args.recorded_latency,
+    )
+    gateway = FakeGateway(args.mode, args.recordings, args.upstream, faults, args.on_miss)
+    log(f"Fake gateway ({args.mode}) on http://{args.host}:{args.port}, recordings in {args.recordings}/")
+    try:
+        gateway.serve_forever(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    log(json.dumps(gateway.stats))
+
+
+if __name__ == "__main__":
+    main()
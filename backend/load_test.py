@@ -0,0 +1,150 @@
+"""
+Load driver for the backend: submits jobs to POST /api/jobs, polls each one
+to completion and reports throughput and latency percentiles.
+
+  uv run uvicorn app.main:app --port 8000           # with GATEWAY_BASE_URL pointing at fake_gateway.py
+  uv run python load_test.py --jobs 20 --concurrency 4
+  uv run python load_test.py --jobs 50 --rate 0.5    # open loop: one new job every 2s
+
+Closed loop by default (``--concurrency`` jobs in flight at a time); with
+``--rate`` jobs are started on a fixed schedule regardless of completions.
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+JDR_PDF = "../documents/proposal 1/jdr_proposal.pdf"
+INS_PDF = "../documents/proposal 1/insurance_proposal.pdf"
+
+
+def log(msg: str):
+    print(msg, flush=True)
+
+
+def _multipart(files: dict[str, Path]) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, path in files.items():
+        parts.append(
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{path.name}"\r\n'
+            "Content-Type: application/pdf\r\n\r\n".encode()
+        )
+        parts.append(path.read_bytes())
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def _request(url: str, data: bytes | None = None, content_type: str | None = None) -> bytes:
+    request = urllib.request.Request(url, data=data)
+    if content_type:
+        request.add_header("Content-Type", content_type)
+    with urllib.request.urlopen(request, timeout=60) as resp:
+        return resp.read()
+
+
+def run_job(base_url: str, body: bytes, content_type: str, poll: float, timeout: float) -> dict:
+    """Submit one job and wait for it; returns timings and final status."""
+    start = time.monotonic()
+    job = json.loads(_request(f"{base_url}/api/jobs", body, content_type))
+    submitted = time.monotonic()
+    while job["status"] not in ("complete", "error"):
+        if time.monotonic() - start > timeout:
+            return {"id": job["id"], "status": "timeout", "latency": time.monotonic() - start}
+        time.sleep(poll)
+        job = json.loads(_request(f"{base_url}/api/jobs/{job['id']}"))
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "latency": time.monotonic() - start,
+        "submit_latency": submitted - start,
+        "error": job.get("error"),
+        "llm": job.get("llm", {}),
+    }
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile of ``values`` (q in 0-100)."""
+    ordered = sorted(values)
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+
+def report(results: list[dict], wall: float) -> None:
+    done = [r for r in results if r["status"] == "complete"]
+    failed = [r for r in results if r["status"] != "complete"]
+    log(f"\nJobs: {len(results)} submitted, {len(done)} complete, {len(failed)} failed/timed out")
+    log(f"Wall time: {wall:.1f}s   throughput: {len(done) / wall * 60:.2f} jobs/min")
+    if done:
+        latencies = [r["latency"] for r in done]
+        log("Job latency (s): " + "  ".join(
+            f"p{q}={percentile(latencies, q):.1f}" for q in (50, 90, 99)
+        ) + f"  max={max(latencies):.1f}")
+        submits = [r["submit_latency"] for r in done]
+        log(f"Submit latency (s): p50={percentile(submits, 50):.3f}  max={max(submits):.3f}")
+
+    stages: dict[str, dict] = {}
+    for r in done:
+        for stage, entry in r["llm"].items():
+            agg = stages.setdefault(stage, {"calls": 0, "latency_seconds": 0.0, "outcomes": {}})
+            agg["calls"] += entry["calls"]
+            agg["latency_seconds"] += entry["latency_seconds"]
+            for outcome, n in entry["outcomes"].items():
+                agg["outcomes"][outcome] = agg["outcomes"].get(outcome, 0) + n
+    if stages:
+        log("LLM calls per job by stage:")
+        for stage, agg in sorted(stages.items()):
+            outcomes = ", ".join(f"{k}={v / len(done):.1f}" for k, v in sorted(agg["outcomes"].items()))
+            log(f"  {stage:<11} {agg['calls'] / len(done):6.1f} calls   "
+                f"mean {agg['latency_seconds'] / max(agg['calls'], 1):.2f}s   ({outcomes})")
+    for r in failed[:5]:
+        log(f"  {r['id']}: {r['status']} {r.get('error') or ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--jdr", type=Path, default=Path(JDR_PDF))
+    parser.add_argument("--insurance", type=Path, default=Path(INS_PDF))
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2, help="jobs in flight (closed loop)")
+    parser.add_argument("--rate", type=float, default=0.0, help="jobs started per second (open loop)")
+    parser.add_argument("--poll", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=1800.0, help="per-job timeout in seconds")
+    parser.add_argument("--json", type=Path, help="write per-job results here")
+    args = parser.parse_args()
+
+    body, content_type = _multipart({"jdr": args.jdr, "insurance": args.insurance})
+    workers = args.jobs if args.rate > 0 else args.concurrency
+    results: list[dict] = []
+    lock = threading.Lock()
+
+    def one(i: int) -> None:
+        if args.rate > 0:
+            time.sleep(max(0.0, start + i / args.rate - time.monotonic()))
+        try:
+            r = run_job(args.url, body, content_type, args.poll, args.timeout)
+        except OSError as e:
+            r = {"id": f"#{i}", "status": "request failed", "error": str(e), "latency": 0.0}
+        with lock:
+            results.append(r)
+            log(f"[{len(results)}/{args.jobs}] {r['id'][:8]} {r['status']} in {r['latency']:.1f}s")
+
+    log(f"Submitting {args.jobs} jobs to {args.url} "
+        + (f"at {args.rate}/s" if args.rate > 0 else f"with {args.concurrency} in flight"))
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(one, range(args.jobs)))
+    report(results, time.monotonic() - start)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()